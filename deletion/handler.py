@@ -2,12 +2,14 @@ import os
 import aiohttp
 from dotenv import load_dotenv
 from util.qdrant_connection import vectordb_client
+from retrieval.answer_cache import answer_cache
 
 load_dotenv()
 
 class ChunkDeletionHandler:
     def __init__(self):
         self.client = vectordb_client
+        self.answer_cache = answer_cache
         print("ChunkDeletionHandler initialized")
 
     async def delete_points_by_file_id(self, file_id_value: str, category: str):
@@ -26,7 +28,10 @@ class ChunkDeletionHandler:
 
             async with aiohttp.ClientSession() as session:
                 async with session.post(url, json=payload) as resp:
-                    return await resp.json()
+                    result = await resp.json()
+
+            self.answer_cache.invalidate_file(file_id_value)
+            return result
 
         except Exception as e:
             print(f"❌ An error occurred during deletion: {e}")
@@ -0,0 +1,155 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_THREADS = int(os.getenv("INGEST_THREADS", "2"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "100"))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", "500"))
+
+class IngestionQueueFull(Exception):
+    pass
+
+class IngestionJob:
+    def __init__(self, kind: str, file_id: str, category: str, filename: str, content: bytes, runner):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.file_id = file_id
+        self.category = category
+        self.filename = filename
+        self.content = content
+        self.runner = runner
+        self.status = "queued"
+        self.stage = "queued"
+        self.pages_done = 0
+        self.pages_total = 0
+        self.chunks_upserted = 0
+        self.memory = {}
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+        print(f"[INFO] Ingestion job {self.id} ({self.filename}): {stage}")
+
+    def set_page_progress(self, done: int, total: int):
+        self.pages_done = done
+        self.pages_total = total
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "id": self.file_id,
+            "category": self.category,
+            "filename": self.filename,
+            "status": self.status,
+            "stage": self.stage,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "chunks_upserted": self.chunks_upserted,
+            "memory": self.memory,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+class IngestionJobQueue:
+    """Runs extraction -> chunking -> embedding -> upsert jobs off the request path."""
+
+    def __init__(self, workers: int = INGEST_WORKERS, threads: int = INGEST_THREADS, max_queue: int = INGEST_MAX_QUEUE, history: int = INGEST_JOB_HISTORY):
+        self.workers = workers
+        self.threads = threads
+        self.max_queue = max_queue
+        self.history = history
+        self.jobs = OrderedDict()
+        self.queue = None
+        self.tasks = []
+        self.executor = None
+        self.on_abandon = None
+
+    async def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="ingest")
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"IngestionJobQueue started with {self.workers} workers and {self.threads} threads")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # jobs that never finished must not stay 'processing' forever in document_details
+        for job in self.jobs.values():
+            if job.status in ("queued", "processing"):
+                job.status = "failed"
+                job.error = "service shut down before the job finished"
+                if self.on_abandon is not None:
+                    await self.on_abandon(job)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def submit(self, job: IngestionJob) -> IngestionJob:
+        if self.queue is None:
+            raise IngestionQueueFull("Ingestion workers are not running")
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise IngestionQueueFull(f"Ingestion queue is full ({self.queue.qsize()} jobs waiting)")
+
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            self.jobs.popitem(last=False)
+        return job
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    async def run_blocking(self, fn, *args, **kwargs):
+        """Runs sync, CPU- or IO-heavy ingestion steps on the bounded ingestion threads."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self.queue.get()
+            job.status = "processing"
+            job.started_at = time.time()
+            try:
+                await job.runner(job)
+                job.status = "finished"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                print(f"[ERROR] Ingestion job {job.id} ({job.filename}) failed: {e}")
+            finally:
+                job.finished_at = time.time()
+                # the raw upload is no longer needed once the job is done
+                job.content = None
+                self.queue.task_done()
+
+    def report(self) -> dict:
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {
+            "workers": len(self.tasks),
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "jobs": counts,
+        }
+
+ingestion_queue = IngestionJobQueue()
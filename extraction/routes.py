@@ -1,4 +1,4 @@
-from fastapi import APIRouter, UploadFile, File, Form, Depends
+from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException
 from typing import List
 import re
 import json
@@ -6,8 +6,12 @@ from .services.extractor import PDFExtractorHandler
 from ingestion.chunking.document_processor import DocumentProcessor
 from ingestion.ingest import parse_chunk_text
 from ingestion.embedding import upsert_documents
+from retrieval.answer_cache import answer_cache
 from middleware.auth import verify_api_key
 from .repository import ExtractRepository
+from .jobs import IngestionJob, IngestionQueueFull, ingestion_queue
+from .services.ocr_cache import ocr_cache
+from util.vlm_client import vlm_client
 import fitz
 import time
 from datetime import datetime
@@ -47,7 +51,85 @@ class PDFRoutes:
             f"Category: {category}, Start time: {start}, End time: {end}"
         )
 
+    async def _upsert(self, job: IngestionJob, chunks: list):
+        job.set_stage("upserting")
+        await ingestion_queue.run_blocking(upsert_documents, chunks)
+        job.chunks_upserted = len(chunks)
+        answer_cache.invalidate_file(job.file_id)
+
+    async def _run_job(self, job: IngestionJob, pipeline):
+        start = datetime.now(self.TZ_JAKARTA).strftime("%Y-%m-%d %H:%M:%S")
+        await self._update_status("processing", job.file_id)
+        try:
+            await pipeline(job)
+        except Exception:
+            await self._update_status("failed", job.file_id)
+            raise
+        end = datetime.now(self.TZ_JAKARTA).strftime("%Y-%m-%d %H:%M:%S")
+        self._log_info(job.file_id, job.filename, job.category, start, end)
+        await self._update_status("finished", job.file_id)
+
+    async def _pdf_pipeline(self, job: IngestionJob):
+        job.set_stage("extracting")
+        text = await self.handler.extract_bytes(job.content, job.category, job.filename, on_page=job.set_page_progress, metrics=job.memory)
+        if text.startswith("[ERROR processing uploaded file"):
+            raise RuntimeError(text)
+
+        job.set_stage("chunking")
+        metadata = {"file_id": job.file_id, "category": job.category, "filename": job.filename}
+        processed_chunks = await ingestion_queue.run_blocking(self._process_chunks, text, metadata)
+
+        await self._upsert(job, processed_chunks)
+
+    async def _txt_pipeline(self, job: IngestionJob):
+        job.set_stage("chunking")
+        text = job.content.decode("utf-8").strip()
+        base_metadata = {
+            "file_id": job.file_id,
+            "category": job.category,
+            "filename": job.filename
+        }
+
+        has_delimiter = "---text---" in text
+        has_faq_pattern = bool(re.search(r"(?mi)^\s*q\s*[:\-]", text))
+
+        if has_delimiter or has_faq_pattern:
+            all_chunks = parse_chunk_text(text, default_metadata=base_metadata)
+        else:
+            all_chunks = await ingestion_queue.run_blocking(self._process_chunks, text, base_metadata)
+
+        await self._upsert(job, all_chunks)
+
+    async def _enqueue(self, kind: str, id: str, category: str, filename: str, file: UploadFile, pipeline):
+        # the upload is closed once the response is sent, so the job keeps its own copy
+        content = await file.read()
+        job = IngestionJob(kind, id, category, filename, content, lambda job: self._run_job(job, pipeline))
+        # written first: a worker can pick the job up, and set 'processing', as soon as it is submitted
+        await self._update_status("queued", id)
+        try:
+            ingestion_queue.submit(job)
+        except IngestionQueueFull as e:
+            print(f"[WARN] {e}")
+            await self._update_status("failed", id)
+            raise HTTPException(status_code=503, detail=str(e))
+
+        print(f"[INFO] Queued {kind} ingestion job {job.id} for file {id} ({filename})")
+        return {
+            "data": {
+                "id": id,
+                "category": category,
+                "filename": filename,
+                "job_id": job.id,
+                "status": job.status
+            }
+        }
+
+    async def _mark_abandoned(self, job: IngestionJob):
+        await self._update_status("failed", job.file_id)
+
     def setup_routes(self):
+        ingestion_queue.on_abandon = self._mark_abandoned
+
         @self.router.post("/pdf")
         async def extract_pdf(
             id: str = Form(...),
@@ -57,45 +139,7 @@ class PDFRoutes:
             key_checked: str = Depends(verify_api_key)
         ):
             print("Processing PDF")
-
-            start = datetime.now(self.TZ_JAKARTA).strftime("%Y-%m-%d %H:%M:%S")
-            await self._update_status("processing", id)
-
-            try:
-                text = await self.handler.extract_text(file, category)
-
-                # proses ingestion
-                metadata={"file_id": id, "category": category, "filename": filename}
-                processed_chunks = self._process_chunks(text, metadata)
-
-                upsert_documents(processed_chunks)
-
-                end = datetime.now(self.TZ_JAKARTA).strftime("%Y-%m-%d %H:%M:%S")
-
-                self._log_info(id, filename, category, start, end)
-
-                await self._update_status("finished", id)
-
-                return {
-                    "data": {
-                        "id": id,
-                        "category": category,
-                        "filename": filename,
-                        "chunks_upserted": len(processed_chunks)
-                    }
-                }
-            except Exception as e:
-                await self._update_status("failed", id)
-                return {
-                    "data": {
-                        "id": id,
-                        "category": category,
-                        "filename": filename,
-                        "error": str(e)
-                    }
-                }
-            finally:
-                print("extract pdf completed (success or error)")
+            return await self._enqueue("pdf", id, category, filename, file, self._pdf_pipeline)
 
         @self.router.post("/txt")
         async def extract_txt(
@@ -106,53 +150,36 @@ class PDFRoutes:
             key_checked: str = Depends(verify_api_key)
         ):
             print("Processing TXT...")
-            start = datetime.now(self.TZ_JAKARTA).strftime("%Y-%m-%d %H:%M:%S")
-
-            await self._update_status("processing", id)
+            return await self._enqueue("txt", id, category, filename, file, self._txt_pipeline)
 
-            try:
-                content = await file.read()
-                text = content.decode("utf-8").strip()
-                base_metadata = {
-                    "file_id": id,
-                    "category": category,
-                    "filename": filename
-                }
-
-                has_delimiter = "---text---" in text
-                has_faq_pattern = bool(re.search(r"(?mi)^\s*q\s*[:\-]", text))
-        
-                if has_delimiter or has_faq_pattern:
-                    all_chunks = parse_chunk_text(text, default_metadata=base_metadata)
-                else:
-                    all_chunks = self._process_chunks(text, base_metadata)
-
-                upsert_documents(all_chunks)
-
-                end = datetime.now(self.TZ_JAKARTA).strftime("%Y-%m-%d %H:%M:%S")
-
-                self._log_info(id, filename, category, start, end)
-
-                await self._update_status("finished", id)
+        @self.router.post("/triage")
+        async def triage_pdf(
+            file: UploadFile = File(...),
+            key_checked: str = Depends(verify_api_key)
+        ):
+            # dry run: shows which extraction path each page would take, nothing is ingested
+            content = await file.read()
+            report = await self.handler.triage_report(content)
+            return {"data": {"filename": file.filename, **report}}
+
+        @self.router.get("/jobs/{job_id}")
+        async def get_job(
+            job_id: str,
+            key_checked: str = Depends(verify_api_key)
+        ):
+            job = ingestion_queue.get(job_id)
+            if job is None:
+                raise HTTPException(status_code=404, detail="Job not found")
+            return {"data": job.to_dict()}
 
-                return {
-                    "data": {
-                        "id": id,
-                        "category": category,
-                        "filename": filename,
-                        "chunks_upserted": len(all_chunks)
-                    }
-                }
-            except Exception as e:
-                if not id.startswith("faq-"):
-                    await self._update_status("failed", id)
-                return {
-                    "data": {
-                        "id": id,
-                        "category": category,
-                        "filename": filename,
-                        "error": str(e)
-                    }
+        @self.router.get("/jobs")
+        async def list_jobs(
+            key_checked: str = Depends(verify_api_key)
+        ):
+            return {
+                "data": {
+                    **ingestion_queue.report(),
+                    "vlm": vlm_client.report(),
+                    "ocr_cache": ocr_cache.report()
                 }
-            finally:
-                print("extract txt completed (success or error)")
+            }
@@ -1,21 +1,26 @@
 import os
 import base64
-import fitz
-import pdfplumber
-import httpx
-import requests
+import asyncio
 from dotenv import load_dotenv
 from extraction.prompts.extract_prompt import ExtractPDFPrompts
+from util.vlm_client import vlm_client, VLM_CONCURRENCY
+from extraction.services.ocr_cache import ocr_cache
+from extraction.services.page_source import PDFPageSource, run_pdf_work
+from extraction.services.page_triage import page_triage, PAGE_TRIAGE_ENABLED, ROUTE_TABLE, ROUTE_VLM
 from fastapi import UploadFile
 
 load_dotenv()
 
-MIN_TEXT_THRESHOLD = 100
 IMAGE_DPI = 200
 
 VLM_BASE_URL = os.getenv("OLLAMA_BASE_URL")
 VLM_MODEL = os.getenv("VLM_MODEL")
 VLM_TEMPERATURE = float(os.getenv("VLM_TEMPERATURE"))
+VLM_USER_PROMPT = "Analyze the image."
+VLM_MAX_RETRIES = int(os.getenv("VLM_MAX_RETRIES", "2"))
+VLM_RETRY_DELAY = float(os.getenv("VLM_RETRY_DELAY", "5"))
+# rendered pages waiting for the VLM are held in memory, so rendering only runs this far ahead
+VLM_MAX_PENDING_PAGES = int(os.getenv("VLM_MAX_PENDING_PAGES", str(VLM_CONCURRENCY * 2)))
 
 class PDFExtractorHandler:
     def __init__(self):
@@ -24,21 +29,38 @@ class PDFExtractorHandler:
         self.temperature = VLM_TEMPERATURE
         print("PDFExtractor handler initialized")
 
-    def _analyze_page(self, fitz_page):
-        text = fitz_page.get_text()
-        if len(text) < MIN_TEXT_THRESHOLD:
-            return True
-        if len(fitz_page.get_drawings()) > 0:
-            return True
-        if len(fitz_page.get_images()) > 0:
-            return True
-        return False
+    def _analyze_page(self, fitz_page) -> str:
+        if not PAGE_TRIAGE_ENABLED:
+            return page_triage.legacy_route(fitz_page)
+        return page_triage.classify(fitz_page).route
+
+    def _format_table(self, rows: list) -> str:
+        lines = []
+        for row in rows:
+            cells = [" ".join((cell or "").split()) for cell in row]
+            if any(cells):
+                lines.append("; ".join(cells))
+        return "\n".join(lines)
+
+    def _extract_tables(self, plumber_page) -> str:
+        tables = plumber_page.find_tables()
+        if not tables:
+            return plumber_page.extract_text(x_tolerance=0.5) or ""
+
+        outside = plumber_page
+        for table in tables:
+            outside = outside.outside_bbox(table.bbox)
+        parts = [outside.extract_text(x_tolerance=0.5) or ""]
+        parts.extend(self._format_table(table.extract()) for table in tables)
+        return "\n\n".join(part.strip() for part in parts if part.strip())
 
     async def _call_vlm(self, image_bytes: bytes) -> str:
-        try:
-            image_b64 = base64.b64encode(image_bytes).decode("utf-8")
-        except Exception as e:
-            return f"[ERROR: Base64 encode failed - {e}]"
+        cache_key = ocr_cache.key(self.model, ExtractPDFPrompts.SYSTEM_PROMPT + VLM_USER_PROMPT, image_bytes)
+        cached = await ocr_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        image_b64 = base64.b64encode(image_bytes).decode("utf-8")
 
         payload = {
             "model": self.model,
@@ -47,55 +69,122 @@ class PDFExtractorHandler:
                 {"role": "system", "content": ExtractPDFPrompts.SYSTEM_PROMPT},
                 {
                     "role": "user",
-                    "content": "Analyze the image.",
+                    "content": VLM_USER_PROMPT,
                     "images": [image_b64]
                 }
             ]
         }
+        text = await vlm_client.chat(payload)
+        await ocr_cache.put(cache_key, text)
+        return text
 
-        async with httpx.AsyncClient(timeout=600) as client:
+    async def _ocr_page(self, page_number: int, image_bytes: bytes) -> str:
+        for attempt in range(VLM_MAX_RETRIES + 1):
             try:
-                resp = await client.post(
-                    f"{self.base_url.rstrip('/')}/api/chat",
-                    json=payload,
-                    timeout=600
-                )
-                resp.raise_for_status()
-                data = resp.json()
-                return data["message"]["content"]
-            except requests.exceptions.RequestException as e:
-                return f"[ERROR calling VLM: {e}]"
+                return await self._call_vlm(image_bytes)
+            except Exception as e:
+                if attempt == VLM_MAX_RETRIES:
+                    raise RuntimeError(f"VLM failed on page {page_number} after {attempt + 1} attempts: {e}")
+                print(f"[WARN] VLM failed on page {page_number} (attempt {attempt + 1}/{VLM_MAX_RETRIES + 1}): {e}")
+                await asyncio.sleep(VLM_RETRY_DELAY * (2 ** attempt))
+
+    def _prepare_page(self, source: PDFPageSource, index: int):
+        """Returns (text, None) for text and table pages or (None, jpg bytes) for pages that need the VLM."""
+        page = source.page(index)
+        try:
+            route = self._analyze_page(page.fitz)
+            if route == ROUTE_VLM:
+                pix = page.fitz.get_pixmap(dpi=IMAGE_DPI)
+                return None, pix.tobytes("jpg")
+            if route == ROUTE_TABLE:
+                return self._extract_tables(page.plumber), None
+            return page.plumber.extract_text(x_tolerance=0.5) or "", None
+        finally:
+            page.release()
+
+    async def triage_report(self, content: bytes) -> dict:
+        return await run_pdf_work(page_triage.report, content)
+
+    def _extract_plumber_text(self, content: bytes, on_page=None, metrics: dict = None) -> list[str]:
+        all_pages = []
+        with PDFPageSource(content, primary="plumber") as source:
+            total = len(source)
+            for i, page in enumerate(source.pages()):
+                page_text = page.plumber.extract_text(x_tolerance=0.5)
+                if page_text is None:
+                    page_text = ""
+                all_pages.append(page_text.strip())
+                if on_page is not None:
+                    on_page(i + 1, total)
+        self._log_memory(source, metrics)
+        return all_pages
+
+    def _log_memory(self, source: PDFPageSource, metrics: dict = None):
+        report = source.report()
+        print(
+            f"[INFO] PDF pages: {report['pages']} (fitz {report['fitz_pages']}, pdfplumber {report['plumber_pages']}), "
+            f"RSS start {report['rss_start_mb']} MB, peak {report['rss_peak_mb']} MB, end {report['rss_end_mb']} MB"
+        )
+        if metrics is not None:
+            metrics.update(report)
 
     async def extract_text(self, file: UploadFile, category: str) -> str:
+        content = await file.read()
+        return await self.extract_bytes(content, category, file.filename)
+
+    async def extract_bytes(self, content: bytes, category: str, filename: str = "", on_page=None, metrics: dict = None) -> str:
         try:
-            content = await file.read()
-            all_pages = []
             if category == "panduan":
-                with pdfplumber.open(file.file) as plumber_doc:
-                    for plumber_page in plumber_doc.pages:
-                        page_text = plumber_page.extract_text(x_tolerance=0.5)
-                        if page_text is None:
-                            page_text = ""
-                        all_pages.append(page_text.strip())
+                all_pages = await run_pdf_work(self._extract_plumber_text, content, on_page, metrics)
                 return "\n\n".join(all_pages)
-            
-            file.file.seek(0)
 
-            with fitz.open(stream=content, filetype="pdf") as fitz_doc, \
-                 pdfplumber.open(file.file) as plumber_doc: 
-                for i in range(len(fitz_doc)):
-                    fitz_page = fitz_doc.load_page(i)
-                    plumber_page = plumber_doc.pages[i]
+            source = PDFPageSource(content)
+            try:
+                total = await run_pdf_work(len, source)
+                all_pages = [""] * total
+                done = 0
+                pending = asyncio.Semaphore(VLM_MAX_PENDING_PAGES)
+                tasks = []
+
+                def page_done():
+                    nonlocal done
+                    done += 1
+                    if on_page is not None:
+                        on_page(done, total)
 
-                    if self._analyze_page(fitz_page):
-                        pix = fitz_page.get_pixmap(dpi=IMAGE_DPI)
-                        page_text = await self._call_vlm(pix.tobytes("jpg"))
-                    else:
-                        page_text = plumber_page.extract_text(x_tolerance=0.5) or ""
+                async def ocr(index: int, image_bytes: bytes):
+                    try:
+                        all_pages[index] = (await self._ocr_page(index + 1, image_bytes)).strip()
+                        page_done()
+                    finally:
+                        pending.release()
 
-                    all_pages.append(page_text.strip())
+                try:
+                    # pages are rendered one at a time on the pdf thread while the VLM works
+                    # through the already rendered ones
+                    for i in range(total):
+                        await pending.acquire()
+                        page_text, image_bytes = await run_pdf_work(self._prepare_page, source, i)
+                        if image_bytes is None:
+                            pending.release()
+                            all_pages[i] = page_text.strip()
+                            page_done()
+                        else:
+                            tasks.append(asyncio.create_task(ocr(i, image_bytes)))
+                        # a page that ran out of retries fails the document, no need to render the rest
+                        failed = next((t for t in tasks if t.done() and t.exception()), None)
+                        if failed is not None:
+                            raise failed.exception()
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            finally:
+                await run_pdf_work(source.close)
 
+            self._log_memory(source, metrics)
             return "\n\n".join(all_pages)
 
         except Exception as e:
-            return f"[ERROR processing uploaded file {file.filename}: {e}]"
+            return f"[ERROR processing uploaded file {filename}: {e}]"
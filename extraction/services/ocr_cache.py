@@ -0,0 +1,173 @@
+import os
+import uuid
+import asyncio
+import hashlib
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+OCR_CACHE_ENABLED = os.getenv("OCR_CACHE_ENABLED", "true").lower() == "true"
+OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", "ocr_cache")
+OCR_CACHE_MAX_MB = float(os.getenv("OCR_CACHE_MAX_MB", "512"))
+
+class OCRPageCache:
+    """
+    On-disk cache of VLM output per rendered page.
+
+    The key is a sha256 of the model, the prompt text and the page image, so changing
+    either the model or the prompt misses the old entries. Least recently used files
+    are removed once the directory grows past OCR_CACHE_MAX_MB.
+    """
+
+    def __init__(self, directory: str = OCR_CACHE_DIR, max_bytes: int = int(OCR_CACHE_MAX_MB * 1024 * 1024), enabled: bool = OCR_CACHE_ENABLED):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.index = None
+        self.total_bytes = 0
+        self._index_task = None
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    def key(self, model: str, prompt: str, image_bytes: bytes) -> str:
+        digest = hashlib.sha256()
+        for part in (model.encode("utf-8"), prompt.encode("utf-8"), image_bytes):
+            digest.update(len(part).to_bytes(8, "big"))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".txt"):
+                    continue
+                stat = os.stat(os.path.join(root, name))
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+
+        index = OrderedDict()
+        for _, key, size in sorted(entries):
+            index[key] = size
+        return index
+
+    async def _build_index(self):
+        index = await asyncio.to_thread(self._load_index)
+        self.index = index
+        self.total_bytes = sum(index.values())
+        print(f"OCR cache loaded {len(index)} pages ({self.total_bytes / 1024 / 1024:.1f} MB) from {self.directory}")
+
+    async def _ensure_index(self):
+        if self.index is not None:
+            return
+        # concurrent first lookups share one directory scan
+        if self._index_task is None:
+            self._index_task = asyncio.ensure_future(self._build_index())
+        try:
+            await asyncio.shield(self._index_task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._index_task = None
+            raise
+
+    async def _index_ready(self) -> bool:
+        # a broken cache directory must never fail the OCR itself
+        try:
+            await self._ensure_index()
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[WARN] OCR cache unavailable: {e}")
+            return False
+        return True
+
+    def _read(self, key: str) -> str:
+        path = self._path(key)
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        # mtime doubles as the LRU timestamp when the index is rebuilt on restart
+        os.utime(path)
+        return text
+
+    def _write(self, key: str, text: str) -> int:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # unique per write: the same page can be written twice at once (e.g. a duplicate upload)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return os.path.getsize(path)
+
+    def _remove(self, keys: list[str]):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    async def get(self, key: str):
+        if not self.enabled:
+            return None
+        if not await self._index_ready():
+            return None
+        if key not in self.index:
+            self.stats["misses"] += 1
+            return None
+        try:
+            text = await asyncio.to_thread(self._read, key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            self.stats["misses"] += 1
+            self.total_bytes -= self.index.pop(key, 0)
+            print(f"[WARN] OCR cache read failed for {key}: {e}")
+            return None
+        self.index.move_to_end(key)
+        self.stats["hits"] += 1
+        return text
+
+    async def put(self, key: str, text: str):
+        if not self.enabled:
+            return
+        if not await self._index_ready():
+            return
+        try:
+            size = await asyncio.to_thread(self._write, key, text)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"[WARN] OCR cache write failed for {key}: {e}")
+            return
+        self.total_bytes += size - self.index.get(key, 0)
+        self.index[key] = size
+        self.index.move_to_end(key)
+        self.stats["writes"] += 1
+
+        evicted = []
+        while self.total_bytes > self.max_bytes and len(self.index) > 1:
+            old_key, old_size = self.index.popitem(last=False)
+            self.total_bytes -= old_size
+            evicted.append(old_key)
+        if evicted:
+            self.stats["evictions"] += len(evicted)
+            await asyncio.to_thread(self._remove, evicted)
+
+    def report(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "pages": len(self.index) if self.index is not None else None,
+            "size_mb": round(self.total_bytes / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+            **self.stats,
+        }
+
+ocr_cache = OCRPageCache()
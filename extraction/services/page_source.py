@@ -0,0 +1,129 @@
+import io
+import os
+import asyncio
+import resource
+from concurrent.futures import ThreadPoolExecutor
+import fitz
+import pdfplumber
+
+# PyMuPDF must not be used from several threads at once, even on separate documents, and
+# store_shrink clears MuPDF's global store. All fitz and pdfplumber work runs on this one thread.
+pdf_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pdf")
+
+async def run_pdf_work(fn, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pdf_executor, fn, *args)
+
+def rss_mb() -> float:
+    """Current resident set size of this process, falling back to the peak where /proc is missing."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class SourcePage:
+    """One page of a PDFPageSource. Each backend's page object is only loaded when asked for."""
+
+    def __init__(self, source, index: int):
+        self.source = source
+        self.index = index
+        self._fitz_page = None
+        self._plumber_page = None
+
+    @property
+    def fitz(self):
+        if self._fitz_page is None:
+            self._fitz_page = self.source.fitz_doc.load_page(self.index)
+            self.source.stats["fitz_pages"] += 1
+        return self._fitz_page
+
+    @property
+    def plumber(self):
+        if self._plumber_page is None:
+            self._plumber_page = self.source.plumber_doc.pages[self.index]
+            self.source.stats["plumber_pages"] += 1
+        return self._plumber_page
+
+    def release(self):
+        if self._plumber_page is not None:
+            # drops pdfminer's parsed chars/objects for this page
+            self._plumber_page.close()
+            self._plumber_page = None
+        self._fitz_page = None
+        self.source.sample_memory()
+
+class PDFPageSource:
+    """
+    Single entry point to a PDF's pages for fitz and pdfplumber.
+
+    Both backends read from the same bytes, each is only opened once a page needs it,
+    and pages are handed out one at a time so their parsed objects can be released
+    before the next page is loaded. Use it only from inside run_pdf_work.
+    """
+
+    def __init__(self, content: bytes, primary: str = "fitz"):
+        self.content = content
+        self.primary = primary
+        self._fitz_doc = None
+        self._plumber_doc = None
+        start = rss_mb()
+        self.stats = {"pages": 0, "fitz_pages": 0, "plumber_pages": 0, "rss_start_mb": start, "rss_peak_mb": start, "rss_end_mb": start}
+
+    @property
+    def fitz_doc(self):
+        if self._fitz_doc is None:
+            self._fitz_doc = fitz.open(stream=self.content, filetype="pdf")
+        return self._fitz_doc
+
+    @property
+    def plumber_doc(self):
+        if self._plumber_doc is None:
+            self._plumber_doc = pdfplumber.open(io.BytesIO(self.content))
+        return self._plumber_doc
+
+    def __len__(self) -> int:
+        if self.primary == "plumber":
+            return len(self.plumber_doc.pages)
+        return len(self.fitz_doc)
+
+    def page(self, index: int) -> SourcePage:
+        self.stats["pages"] += 1
+        return SourcePage(self, index)
+
+    def pages(self):
+        for index in range(len(self)):
+            page = self.page(index)
+            try:
+                yield page
+            finally:
+                page.release()
+
+    def sample_memory(self):
+        if self._fitz_doc is not None:
+            # MuPDF keeps decoded fonts/images in a global store until told otherwise
+            fitz.TOOLS.store_shrink(100)
+        current = rss_mb()
+        self.stats["rss_peak_mb"] = max(self.stats["rss_peak_mb"], current)
+        self.stats["rss_end_mb"] = current
+
+    def close(self):
+        if self._plumber_doc is not None:
+            self._plumber_doc.close()
+            self._plumber_doc = None
+        if self._fitz_doc is not None:
+            self._fitz_doc.close()
+            self._fitz_doc = None
+        self.sample_memory()
+
+    def report(self) -> dict:
+        return {
+            **{key: round(value, 1) if isinstance(value, float) else value for key, value in self.stats.items()},
+            "rss_growth_mb": round(self.stats["rss_peak_mb"] - self.stats["rss_start_mb"], 1),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
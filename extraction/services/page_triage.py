@@ -0,0 +1,143 @@
+import os
+import fitz
+from dotenv import load_dotenv
+from extraction.services.page_source import PDFPageSource
+
+load_dotenv()
+
+MIN_TEXT_THRESHOLD = 100
+
+PAGE_TRIAGE_ENABLED = os.getenv("PAGE_TRIAGE_ENABLED", "true").lower() == "true"
+TRIAGE_MIN_GLYPH_VALIDITY = float(os.getenv("TRIAGE_MIN_GLYPH_VALIDITY", "0.9"))
+TRIAGE_MAX_IMAGE_COVERAGE = float(os.getenv("TRIAGE_MAX_IMAGE_COVERAGE", "0.5"))
+TRIAGE_MAX_GRAPHIC_COVERAGE = float(os.getenv("TRIAGE_MAX_GRAPHIC_COVERAGE", "0.3"))
+TRIAGE_MIN_TEXT_COVERAGE = float(os.getenv("TRIAGE_MIN_TEXT_COVERAGE", "0.05"))
+TRIAGE_TABLE_MIN_LINES = int(os.getenv("TRIAGE_TABLE_MIN_LINES", "3"))
+
+ROUTE_TEXT = "text"
+ROUTE_TABLE = "table"
+ROUTE_VLM = "vlm"
+
+def _area(rect: fitz.Rect) -> float:
+    return max(rect.width, 0) * max(rect.height, 0)
+
+def _coverage(rects: list, page_rect: fitz.Rect) -> float:
+    page_area = _area(page_rect)
+    if not page_area:
+        return 0.0
+    # overlaps are counted twice, which is fine for a threshold check
+    covered = sum(_area(fitz.Rect(rect) & page_rect) for rect in rects)
+    return min(covered / page_area, 1.0)
+
+def glyph_validity(text: str) -> float:
+    """Share of visible characters that are real glyphs rather than replacement/private-use codes."""
+    visible = [ch for ch in text if not ch.isspace()]
+    if not visible:
+        return 0.0
+    valid = sum(1 for ch in visible if ch.isprintable() and ch != "\ufffd" and not 0xE000 <= ord(ch) <= 0xF8FF)
+    return valid / len(visible)
+
+class PageDecision:
+    def __init__(self, route: str, reason: str, scores: dict):
+        self.route = route
+        self.reason = reason
+        self.scores = scores
+
+    def to_dict(self) -> dict:
+        return {"route": self.route, "reason": self.reason, "scores": self.scores}
+
+class PageTriage:
+    """
+    Decides per page whether the text layer can be used as is, needs pdfplumber's table
+    extraction, or has to go through the VLM.
+    """
+
+    def _line_counts(self, drawings: list, page_rect: fitz.Rect):
+        horizontal = vertical = 0
+        graphics = []
+        min_length = page_rect.width * 0.1
+        for path in drawings:
+            has_curve = False
+            for item in path["items"]:
+                kind = item[0]
+                if kind == "l":
+                    p1, p2 = item[1], item[2]
+                    if abs(p1.y - p2.y) < 1 and abs(p1.x - p2.x) >= min_length:
+                        horizontal += 1
+                    elif abs(p1.x - p2.x) < 1 and abs(p1.y - p2.y) >= min_length / 4:
+                        vertical += 1
+                elif kind == "re":
+                    rect = item[1]
+                    # tables are often drawn as thin filled rectangles or as cell boxes
+                    if rect.height < 2 and rect.width >= min_length:
+                        horizontal += 1
+                    elif rect.width < 2 and rect.height >= min_length / 4:
+                        vertical += 1
+                    elif rect.width >= min_length and rect.height >= 2:
+                        horizontal += 2
+                        vertical += 2
+                elif kind in ("c", "qu"):
+                    has_curve = True
+            if has_curve:
+                graphics.append(path["rect"])
+        return horizontal, vertical, graphics
+
+    def classify(self, fitz_page) -> PageDecision:
+        page_rect = fitz_page.rect
+        text = fitz_page.get_text()
+        text_rects = [block[:4] for block in fitz_page.get_text("blocks") if block[6] == 0]
+        image_rects = [info["bbox"] for info in fitz_page.get_image_info()]
+        horizontal, vertical, graphic_rects = self._line_counts(fitz_page.get_drawings(), page_rect)
+
+        scores = {
+            "chars": len(text.strip()),
+            "glyph_validity": round(glyph_validity(text), 3),
+            "text_coverage": round(_coverage(text_rects, page_rect), 3),
+            "image_coverage": round(_coverage(image_rects, page_rect), 3),
+            "graphic_coverage": round(_coverage(graphic_rects, page_rect), 3),
+            "horizontal_lines": horizontal,
+            "vertical_lines": vertical,
+        }
+
+        if scores["chars"] < MIN_TEXT_THRESHOLD:
+            return PageDecision(ROUTE_VLM, "no usable text layer", scores)
+        if scores["glyph_validity"] < TRIAGE_MIN_GLYPH_VALIDITY:
+            return PageDecision(ROUTE_VLM, "text layer has broken glyphs", scores)
+        if scores["image_coverage"] > TRIAGE_MAX_IMAGE_COVERAGE:
+            return PageDecision(ROUTE_VLM, "page is mostly image", scores)
+        if scores["graphic_coverage"] > TRIAGE_MAX_GRAPHIC_COVERAGE and scores["text_coverage"] < TRIAGE_MIN_TEXT_COVERAGE:
+            return PageDecision(ROUTE_VLM, "page is mostly a vector graphic", scores)
+        if horizontal >= TRIAGE_TABLE_MIN_LINES and vertical >= 2:
+            return PageDecision(ROUTE_TABLE, "ruled table", scores)
+        return PageDecision(ROUTE_TEXT, "clean text layer", scores)
+
+    def legacy_route(self, fitz_page) -> str:
+        """The previous rule: any drawing or image sends the page to the VLM."""
+        if len(fitz_page.get_text()) < MIN_TEXT_THRESHOLD:
+            return ROUTE_VLM
+        if len(fitz_page.get_drawings()) > 0 or len(fitz_page.get_images()) > 0:
+            return ROUTE_VLM
+        return ROUTE_TEXT
+
+    def report(self, content: bytes) -> dict:
+        """Dry run: classifies every page without rendering or calling the VLM."""
+        routes = {ROUTE_TEXT: 0, ROUTE_TABLE: 0, ROUTE_VLM: 0}
+        legacy = {ROUTE_TEXT: 0, ROUTE_VLM: 0}
+        pages = []
+        with PDFPageSource(content) as source:
+            for i, page in enumerate(source.pages()):
+                decision = self.classify(page.fitz)
+                legacy_route = self.legacy_route(page.fitz)
+                routes[decision.route] += 1
+                legacy[legacy_route] += 1
+                pages.append({"page": i + 1, "legacy_route": legacy_route, **decision.to_dict()})
+
+        return {
+            "pages": len(pages),
+            "routes": routes,
+            "legacy_routes": legacy,
+            "memory": source.report(),
+            "details": pages,
+        }
+
+page_triage = PageTriage()
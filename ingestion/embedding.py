@@ -1,14 +1,14 @@
 import os
 import time
-import requests
 from typing import List
 from dotenv import load_dotenv
 from util.qdrant_connection import vectordb_client
+from util.vectorstore_registry import vectorstore_registry
+from util.bm25_client import bm25_client
 from langchain_core.documents import Document
 from langchain_ollama import OllamaEmbeddings
 from langchain_qdrant import QdrantVectorStore, RetrievalMode
 from qdrant_client import models
-from qdrant_client.models import SparseVector
 from qdrant_client.http.models import Distance, SparseVectorParams, VectorParams
 
 load_dotenv()
@@ -16,7 +16,6 @@ load_dotenv()
 EMBEDDINGS_MODEL = os.getenv("EMBED_MODEL")
 EMBEDDINGS_BASE_URL = os.getenv("OLLAMA_BASE_URL")
 QDRANT_URL = os.getenv("QDRANT_URL")
-BM25_URL = os.getenv("BM25_URL")
 DENSE_VECTOR_SIZE = 2560
 
 embedding_model = OllamaEmbeddings(
@@ -24,42 +23,7 @@ embedding_model = OllamaEmbeddings(
     base_url=EMBEDDINGS_BASE_URL
 )
 
-class BM25SparseEmbedder:
-    def __init__(self, url: str):
-        self.url = url
-
-    def embed_documents(self, texts: list[str]):
-        try:
-            response = requests.post(self.url, json={"texts": texts})
-            response.raise_for_status()
-            raw_vectors = response.json()["vectors"]
-
-            processed = []
-            for v in raw_vectors:
-
-                indices = v.get("indices", [])
-                values = v.get("values", [])
-
-                processed.append(
-                    SparseVector(
-                        indices=indices,
-                        values=values
-                    )
-                )
-
-            return processed
-
-        except Exception as e:
-            print("Error from BM25:", e)
-            return [
-                SparseVector(indices=[], values=[])
-                for _ in texts
-            ]
-
-    def embed_query(self, text: str):
-        return self.embed_documents([text])[0]
-
-sparse_embedder = BM25SparseEmbedder(BM25_URL)
+sparse_embedder = bm25_client
 
 def upsert_documents(
     documents: List[Document],
@@ -90,6 +54,8 @@ def upsert_documents(
                     "sparse": SparseVectorParams(index=models.SparseIndexParams(on_disk=False))
                 },
             )
+            existing_collections.append(collection_name)
+            vectorstore_registry.refresh(collection_name)
 
         vectorstore = QdrantVectorStore(
             client=client,
@@ -6,6 +6,15 @@ from retrieval.routes import ChatflowRoutes
 from extraction.routes import PDFRoutes
 from deletion.routes import DeleteRoutes
 from util.db_connection import init_db, close_db
+from util.write_behind import analytics_writer
+from util.config_cache import config_cache
+from util.bm25_client import bm25_client
+from util.ollama_client import init_async_ollama_client, close_async_ollama_client
+from retrieval.rerank_new import rerank_client
+from retrieval.repository import drain_pending_turn_writes
+from retrieval.enrichment import enrichment_pool
+from extraction.jobs import ingestion_queue
+from util.vlm_client import vlm_client
 
 class DokuprimeAIAPI:
     def __init__(self):
@@ -27,15 +36,42 @@ class DokuprimeAIAPI:
         await init_db()
         print(">>> DB pool initialized")
 
+        await analytics_writer.start()
+        await config_cache.start()
+        await enrichment_pool.start()
+        await ingestion_queue.start()
+
+        await rerank_client.start()
+
+        init_async_ollama_client()
+        print(">>> Ollama client initialized")
+
         yield
 
+        await self.chatflow_routes.drain_stream_tasks()
+        await drain_pending_turn_writes()
+        await enrichment_pool.stop()
+        await ingestion_queue.stop()
+        await analytics_writer.stop()
+        await config_cache.stop()
+
         print(">>> Shutting down: Closing DB pool...")
         await close_db()
         print(">>> DB pool closed")
 
+        await bm25_client.aclose()
+        print(">>> BM25 client closed")
+
+        await rerank_client.aclose()
+
+        await close_async_ollama_client()
+        print(">>> Ollama client closed")
+
+        await vlm_client.aclose()
+
     def include_routers(self):
-        chatflow_routes = ChatflowRoutes()
-        self.app.include_router(chatflow_routes.router, prefix="/chat")
+        self.chatflow_routes = ChatflowRoutes()
+        self.app.include_router(self.chatflow_routes.router, prefix="/chat")
 
         pdf_routes = PDFRoutes()
         self.app.include_router(pdf_routes.router, prefix="/extract")
@@ -0,0 +1,105 @@
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+import util.db_connection as db_connection
+from util.db_connection import pool_stats
+from util.inference_limiter import inference_scheduler
+
+load_dotenv()
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+ADMISSION_MAX_QUEUE_DEPTH = int(os.getenv("ADMISSION_MAX_QUEUE_DEPTH", "24"))
+ADMISSION_MAX_DB_USAGE = float(os.getenv("ADMISSION_MAX_DB_USAGE", "0.9"))
+ADMISSION_MAX_P95_LATENCY = float(os.getenv("ADMISSION_MAX_P95_LATENCY", "90"))
+ADMISSION_LATENCY_WINDOW = float(os.getenv("ADMISSION_LATENCY_WINDOW", "60"))
+ADMISSION_MIN_SAMPLES = int(os.getenv("ADMISSION_MIN_SAMPLES", "20"))
+
+class AdmissionController:
+    def __init__(self, enabled: bool = ADMISSION_ENABLED, max_inflight: int = ADMISSION_MAX_INFLIGHT, max_queue_depth: int = ADMISSION_MAX_QUEUE_DEPTH, max_db_usage: float = ADMISSION_MAX_DB_USAGE, max_p95_latency: float = ADMISSION_MAX_P95_LATENCY, latency_window: float = ADMISSION_LATENCY_WINDOW, min_samples: int = ADMISSION_MIN_SAMPLES):
+        self.enabled = enabled
+        self.max_inflight = max_inflight
+        self.max_queue_depth = max_queue_depth
+        self.max_db_usage = max_db_usage
+        self.max_p95_latency = max_p95_latency
+        self.latency_window = latency_window
+        self.min_samples = min_samples
+        self.inflight = 0
+        self.latencies = deque(maxlen=1000)
+        self.stats = {"admitted": 0, "shed": 0, "shed_reasons": {}}
+        print("AdmissionController initialized")
+
+    def _recent_latencies(self) -> list[float]:
+        # samples age out by time so shedding stops once the slow period has passed
+        cutoff = time.monotonic() - self.latency_window
+        while self.latencies and self.latencies[0][0] < cutoff:
+            self.latencies.popleft()
+        return [duration for _, duration in self.latencies]
+
+    def p95_latency(self) -> float:
+        recent = sorted(self._recent_latencies())
+        if len(recent) < self.min_samples:
+            return 0.0
+        return recent[min(len(recent) - 1, int(len(recent) * 0.95))]
+
+    def db_usage(self) -> float:
+        pool = db_connection.pool
+        if pool is None:
+            return 0.0
+        return pool_stats(pool)["in_use"] / pool.get_max_size()
+
+    def check(self):
+        if self.inflight >= self.max_inflight:
+            return "inflight"
+        if inference_scheduler.queue_depth() >= self.max_queue_depth:
+            return "inference_queue"
+        if self.db_usage() >= self.max_db_usage:
+            return "db_pool"
+        if self.p95_latency() >= self.max_p95_latency:
+            return "latency"
+        return None
+
+    def admit(self) -> bool:
+        if not self.enabled:
+            self.stats["admitted"] += 1
+            return True
+
+        reason = self.check()
+        if reason is None:
+            self.stats["admitted"] += 1
+            return True
+
+        self.stats["shed"] += 1
+        self.stats["shed_reasons"][reason] = self.stats["shed_reasons"].get(reason, 0) + 1
+        print(f"[WARN] Shedding chat request: {reason}")
+        return False
+
+    @asynccontextmanager
+    async def track(self):
+        self.inflight += 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+            self.latencies.append((time.monotonic(), time.perf_counter() - start))
+
+    def report(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "inflight": self.inflight,
+            "inference_queue_depth": inference_scheduler.queue_depth(),
+            "db_usage": self.db_usage(),
+            "p95_latency": self.p95_latency(),
+            "thresholds": {
+                "max_inflight": self.max_inflight,
+                "max_queue_depth": self.max_queue_depth,
+                "max_db_usage": self.max_db_usage,
+                "max_p95_latency": self.max_p95_latency,
+            },
+            **self.stats,
+        }
+
+admission_controller = AdmissionController()
@@ -0,0 +1,166 @@
+import os
+import re
+import time
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_MAX_SIZE = int(os.getenv("ANSWER_CACHE_MAX_SIZE", "1000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+def normalize_query(text: str) -> str:
+    text = (text or "").lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+def numeric_tokens(text: str) -> frozenset:
+    # Pasal, regulation and KBLI numbers barely move the embedding but change the answer
+    return frozenset(re.findall(r"\d+", normalize_query(text)))
+
+class AnswerCache:
+    def __init__(self, max_size: int = ANSWER_CACHE_MAX_SIZE, ttl: float = ANSWER_CACHE_TTL, similarity_threshold: float = ANSWER_CACHE_SIMILARITY, enabled: bool = ANSWER_CACHE_ENABLED):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        # unit-normalised vectors, one row per entry that has one, allocated on the first put
+        self.matrix = None
+        self.row_used = np.zeros(max_size, dtype=bool)
+        self.row_keys = [None] * max_size
+        self.free_rows = list(range(max_size - 1, -1, -1))
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "numeric_mismatches": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        print("AnswerCache initialized")
+
+    def _key(self, rewritten: str, collection_choice: str, answer_format: str):
+        return (collection_choice, answer_format, normalize_query(rewritten))
+
+    def _is_expired(self, entry: dict) -> bool:
+        return time.monotonic() - entry["created_at"] > self.ttl
+
+    def _store_vector(self, key, query_vector):
+        vector = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.ndim != 1 or norm == 0:
+            return None
+        if self.matrix is None:
+            self.matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+        if vector.shape[0] != self.matrix.shape[1] or not self.free_rows:
+            return None
+
+        row = self.free_rows.pop()
+        self.matrix[row] = vector / norm
+        self.row_used[row] = True
+        self.row_keys[row] = key
+        return row
+
+    def _remove(self, key):
+        entry = self.entries.pop(key)
+        row = entry["row"]
+        if row is not None:
+            self.row_used[row] = False
+            self.row_keys[row] = None
+            self.free_rows.append(row)
+
+    def _purge_expired(self):
+        expired = [key for key, entry in self.entries.items() if self._is_expired(entry)]
+        for key in expired:
+            self._remove(key)
+
+    def get_exact(self, rewritten: str, collection_choice: str, answer_format: str):
+        if not self.enabled:
+            return None
+
+        key = self._key(rewritten, collection_choice, answer_format)
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if self._is_expired(entry):
+            self._remove(key)
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats["exact_hits"] += 1
+        print(f"[INFO] Answer cache exact hit for: {key[2]}")
+        return entry
+
+    def get_similar(self, query_vector, rewritten: str, collection_choice: str, answer_format: str):
+        if not self.enabled or query_vector is None or self.matrix is None:
+            return None
+
+        self._purge_expired()
+        query = np.asarray(query_vector, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0 or query.shape != self.matrix.shape[1:]:
+            self.stats["misses"] += 1
+            return None
+
+        scores = self.matrix @ (query / query_norm)
+        scores[~self.row_used] = -np.inf
+        numbers = numeric_tokens(rewritten)
+        for row in np.argsort(-scores):
+            score = scores[row]
+            if score < self.similarity_threshold:
+                break
+            key = self.row_keys[row]
+            if key[0] != collection_choice or key[1] != answer_format:
+                continue
+            entry = self.entries[key]
+            if entry["numbers"] != numbers:
+                self.stats["numeric_mismatches"] += 1
+                continue
+
+            self.entries.move_to_end(key)
+            self.stats["semantic_hits"] += 1
+            print(f"[INFO] Answer cache semantic hit ({score:.4f}) for: {key[2]}")
+            return entry
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, rewritten: str, collection_choice: str, answer_format: str, answer: str, citations: list, question_category: dict, query_vector=None):
+        if not self.enabled:
+            return
+
+        key = self._key(rewritten, collection_choice, answer_format)
+        if key in self.entries:
+            self._remove(key)
+        while self.entries and len(self.entries) >= self.max_size:
+            self._remove(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+        self.entries[key] = {
+            "answer": answer,
+            "citations": list(citations),
+            "question_category": question_category,
+            "numbers": numeric_tokens(rewritten),
+            "row": self._store_vector(key, query_vector) if query_vector is not None else None,
+            "created_at": time.monotonic(),
+        }
+
+    def set_question_category(self, rewritten: str, collection_choice: str, answer_format: str, question_category: dict):
+        entry = self.entries.get(self._key(rewritten, collection_choice, answer_format))
+        if entry is not None:
+            entry["question_category"] = question_category
+
+    def invalidate_file(self, file_id: str):
+        stale = [
+            key for key, entry in self.entries.items()
+            if any(str(cid) == str(file_id) for cid, _ in entry["citations"])
+        ]
+        for key in stale:
+            self._remove(key)
+
+        self.stats["invalidations"] += len(stale)
+        print(f"[INFO] Answer cache invalidated {len(stale)} entries for file_id: {file_id}")
+        return len(stale)
+
+    def clear(self):
+        for key in list(self.entries):
+            self._remove(key)
+
+answer_cache = AnswerCache()
@@ -3,6 +3,7 @@ import re
 import uuid
 import time
 import asyncio
+import json
 from datetime import datetime
 import pytz
 from dotenv import load_dotenv
@@ -10,16 +11,22 @@ from typing import Tuple
 from .entity.chat_request import ChatRequest
 from .entity.final_answer import FinalResponse
 from .generate_helpdesk_confirmation_answer_new import generate_helpdesk_confirmation_answer_new
-from .generate_answer_new import generate_answer_new
+from .generate_answer_new import generate_answer_new, stream_answer_new, cleanse_llm_response, IncrementalCleanser
 from .classify_kbli import classify_kbli
 from .classify_specific import classify_specific
-from .knowledge_retrieval import retrieve_knowledge, retrieve_knowledge_faq
-from .query_embedding_converter import convert_to_embedding
+from .knowledge_retrieval import retrieve_knowledge, retrieve_knowledge_faq, is_kbli_query, embed_query_vectors
 from .rewriter import rewrite_query
 from .classify_collection import classify_collection
 from .classify_user_query import classify_user_query
 from .rerank_new import rerank_documents
-from .repository import ChatflowRepository
+from .repository import ChatflowRepository, ChatTurnRecord
+from .conversation_state import ConversationState, extract_kbli_codes
+from .answer_cache import answer_cache
+from .enrichment import enrichment_pool, EnrichmentRetry
+from .stream_sink import StreamSink, current_stream_sink, get_stream_sink, emit_event
+from util.inference_ledger import InferenceLedger, current_ledger, get_ledger
+from util.inference_limiter import current_conversation, InferenceQueueFull
+from util.request_budget import start_request_budget, reset_request_budget
 from fastapi.responses import JSONResponse
 
 load_dotenv()
@@ -30,18 +37,25 @@ class ChatflowHandler:
         self.faq_limit = 3
         self.faq_threshold = 0.75
         self.max_retry = 3
+        self.speculative_pipeline = os.getenv("SPECULATIVE_PIPELINE", "true").lower() == "true"
+        self.no_retrieval_choices = {"helpdesk", "skip_collection_check", "greeting_query", "thank_you", "classified_information"}
         self.tz = pytz.timezone("Asia/Jakarta")
         self.llm_helpdesk_new = generate_helpdesk_confirmation_answer_new
         self.rewriter = rewrite_query
         self.classifier = classify_collection
         self.classify_kbli = classify_kbli
         self.classify_specific = classify_specific
-        self.converter = convert_to_embedding
+        self.query_embedder = embed_query_vectors
         self.retriever_faq = retrieve_knowledge_faq
         self.retriever = retrieve_knowledge
         self.rerank_new = rerank_documents
         self.llm_new = generate_answer_new
+        self.llm_stream = stream_answer_new
+        self.ai_disclaimer = "\n\n*Jawaban dibuat oleh AI, bukan sebagai referensi pendapat hukum dan tidak selalu akurat. Mohon lakukan pengecekan tambahan atau lebih detil bila diperlukan.*"
         self.question_classifier = classify_user_query
+        self.overload_message = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
+        self.answer_cache = answer_cache
+        self.enrichment = enrichment_pool
         self.repository = ChatflowRepository()
         print("Chatflow handler initialized")
 
@@ -49,6 +63,11 @@ class ChatflowHandler:
         req: ChatRequest, 
         data: FinalResponse) -> dict:
 
+        ledger = get_ledger()
+        if ledger is not None:
+            data.llm_call_count = ledger.total_calls
+            data.llm_token_count = ledger.total_tokens
+
         return {
             "user": req.platform_unique_id,
             "query": req.query,
@@ -141,7 +160,7 @@ class ChatflowHandler:
         print("Entering handle_skip_collection_answer method")
         is_answered=True
         question_id, answer_id = await self.repository.insert_skip_chat(session_id=ret_conversation_id, human_message=req.query, ai_message=message)
-        await self.repository.flag_message_cannot_answer_by_id(question_id)
+        await self.repository.flag_message_cannot_answer_by_id(ret_conversation_id, question_id)
         await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
         print("Exiting handle_skip_collection_answer method")
         return_data = FinalResponse(
@@ -158,12 +177,12 @@ class ChatflowHandler:
             req=req,
             data=return_data)
     
-    async def handle_default_answering(self, req: ChatRequest, ret_conversation_id: str, rewritten: str, collection_choice: str):
+    async def handle_default_answering(self, req: ChatRequest, ret_conversation_id: str, rewritten: str, collection_choice: str, state: ConversationState):
         print("Entering handle_default_answering method")
 
         basic_return = ""
         if collection_choice == "skip_collection_check":
-            status = await self.repository.check_fail_history(ret_conversation_id)
+            status = state.has_fail_streak()
             helpdesk_active_status = await self.repository.check_helpdesk_activation()
             is_ask_helpdesk = False
             if status:
@@ -197,10 +216,10 @@ class ChatflowHandler:
             req=req,
             data=return_data)
 
-    async def retrieve_faq(self, query_vector: str):
+    async def retrieve_faq(self, query: str, query_vectors=None):
         print("[INFO] Entering retrieve_faq method")        
 
-        results, duration = await self.retriever_faq(query_vector, self.qdrant_faq_name, top_k=self.faq_limit)
+        results, duration = await self.retriever_faq(query, self.qdrant_faq_name, top_k=self.faq_limit, query_vectors=query_vectors)
         if not results:
             print("[INFO] No FAQ results found")
             return {"matched": False, "answer": None, "score": 0.0}, duration
@@ -229,7 +248,7 @@ class ChatflowHandler:
             "citations": citations,
         }, duration
     
-    async def get_filtered_chunks(self, rewritten: str, context: str, texts: list[str], fileids: list[str], filenames: list[str]):
+    async def get_filtered_chunks(self, rewritten: str, context: str, texts: list[str], fileids: list[str], filenames: list[str], scores: list[float]):
         print("Entering get_filtered_chunks method")
         duration_classify_kbli = 0
         duration_classify_specific = 0
@@ -250,15 +269,17 @@ class ChatflowHandler:
                 filtered_texts = []
                 filtered_fileids = []
                 filtered_filenames = []
+                filtered_scores = []
 
                 seen_kbli = set()
 
-                for txt, fid, fname in zip(texts, fileids, filenames):
+                for txt, fid, fname, score in zip(texts, fileids, filenames, scores):
                     match = kbli_pattern.search(txt)
                     if not match:
                         filtered_texts.append(txt)
                         filtered_fileids.append(fid)
                         filtered_filenames.append(fname)
+                        filtered_scores.append(score)
                         continue
 
                     kbli = match.group(1)
@@ -270,16 +291,17 @@ class ChatflowHandler:
                     filtered_texts.append(txt)
                     filtered_fileids.append(fid)
                     filtered_filenames.append(fname)
+                    filtered_scores.append(score)
 
                 print(f"KBLIs: {seen_kbli}")
                 print("Exiting get_filtered_chunks method with no removal")
-                return filtered_texts, filtered_fileids, filtered_filenames, duration_classify_kbli, duration_classify_specific
+                return filtered_texts, filtered_fileids, filtered_filenames, filtered_scores, duration_classify_kbli, duration_classify_specific
 
         print("Exiting get_filtered_chunks method with no removal")
-        return texts, fileids, filenames, duration_classify_kbli, duration_classify_specific
+        return texts, fileids, filenames, scores, duration_classify_kbli, duration_classify_specific
     
     def extract_kbli_code(self, text: str) -> list[str]:
-        return re.findall(r"\b\d{5}\b", text)
+        return extract_kbli_codes(text)
 
     def is_repeating_answer(self, answer: str, min_repeat: int = 5) -> bool:
         words = re.findall(r"\b\w+\b", answer.lower())
@@ -301,7 +323,46 @@ class ChatflowHandler:
 
         return False
 
-    async def handle_full_retrieval(self, req:ChatRequest, ret_conversation_id: str, status: bool, helpdesk_active_status: bool, context: str, rewritten: str, collection_choice: str):
+    def is_failed_answer(self, answer: str) -> bool:
+        return answer.startswith('Mohon maaf, apakah Bapak/Ibu bisa tanyakan dengan lebih detail dan jelas?') or answer.startswith('Mohon maaf, pertanyaan tersebut belum bisa kami jawab.')
+
+    def build_display_answer(self, answer: str, initial_message: str) -> str:
+        if self.is_failed_answer(answer):
+            return (initial_message or "") + answer
+        return (initial_message or "") + answer + self.ai_disclaimer
+
+    async def generate_streamed_answer(self, req: ChatRequest, context: str, status: bool, helpdesk_active_status: bool, context_docs: list[str]):
+        print("Entering generate_streamed_answer method")
+        is_plain = self.get_answer_format(req.platform) == "plain"
+        cleanser = IncrementalCleanser() if is_plain else None
+        raw = ""
+
+        start = time.perf_counter()
+        stream = self.llm_stream(user_query=req.query, history_context=context, status=status, helpdesk_active_status=helpdesk_active_status, context_docs=context_docs)
+        try:
+            async for chunk in stream:
+                raw += chunk
+                token = cleanser.feed(chunk) if cleanser else chunk
+                if token:
+                    emit_event("token", {"text": token})
+                if self.is_repeating_answer(raw[-400:]):
+                    print("[WARN] Repetition detected mid-stream, aborting generation")
+                    break
+        finally:
+            await stream.aclose()
+        if cleanser:
+            token = cleanser.flush()
+            if token:
+                emit_event("token", {"text": token})
+        duration = time.perf_counter() - start
+
+        answer = raw.strip()
+        if is_plain:
+            answer = cleanse_llm_response(text=answer)
+        print("Exiting generate_streamed_answer method")
+        return answer, duration
+
+    async def handle_full_retrieval(self, req:ChatRequest, ret_conversation_id: str, status: bool, helpdesk_active_status: bool, context: str, rewritten: str, collection_choice: str, query_vectors=None, initial_message: str = "", asked_kbli_codes: set = frozenset()):
         print("Entering handle_full_retrieval method")
 
         duration = 0
@@ -309,19 +370,13 @@ class ChatflowHandler:
         duration_llm = 0
         duration_classify_kbli = 0
         duration_classify_specific = 0
-        retrieval, duration = await self.retriever(rewritten, collection_choice)
+        retrieval, duration = await self.retriever(rewritten, collection_choice, query_vectors=query_vectors)
         docs = retrieval["docs"]
         is_kbli_5_digit = retrieval["is_kbli"]
 
         if is_kbli_5_digit:
             current_kbli_code = self.extract_kbli_code(rewritten)
             if current_kbli_code:
-                human_messages = await self.repository.get_rewritten_messages(ret_conversation_id)
-                asked_kbli_codes = set()
-
-                for msg in human_messages:
-                    asked_kbli_codes.update(self.extract_kbli_code(msg))
-
                 print(f"KBLI code that have been asked in session id: {ret_conversation_id}")
                 print(asked_kbli_codes)
 
@@ -332,20 +387,23 @@ class ChatflowHandler:
         texts = []
         fileids = []
         filenames = []
+        scores = []
         for d, s in docs:
             texts.append(d.page_content)
             meta = d.metadata
             fileids.append(meta.get("file_id") or "unknown_source")
             filenames.append(meta.get("filename") or "unknown_source")
+            scores.append(s)
 
         print("Flow KBLI 5 Digit: ", is_kbli_5_digit)
         if is_kbli_5_digit:
             answer = texts[0] if texts else "Informasi untuk kode KBLI tersebut tidak ditemukan. Pastikan kode yang dimasukkan sudah benar atau coba kode KBLI lainnya."
             citations = list(zip(fileids, filenames))
+            emit_event("citations", {"citations": citations})
 
         else:
-            texts, fileids, filenames, duration_classify_kbli, duration_classify_specific = await self.get_filtered_chunks(rewritten=rewritten, context=context, texts=texts, fileids=fileids, filenames=filenames)
-            reranked, citation_id, citation_name, duration_rerank = await self.rerank_new(rewritten, texts, fileids, filenames)
+            texts, fileids, filenames, scores, duration_classify_kbli, duration_classify_specific = await self.get_filtered_chunks(rewritten=rewritten, context=context, texts=texts, fileids=fileids, filenames=filenames, scores=scores)
+            reranked, citation_id, citation_name, duration_rerank = await self.rerank_new(rewritten, texts, fileids, filenames, scores=scores)
             transformed_chunk = []
 
             print("Transformed chunks:")
@@ -360,71 +418,39 @@ class ChatflowHandler:
 
 
             citations = list(zip(citation_id, citation_name))
+            emit_event("citations", {"citations": citations})
             
             retry_count = 0
             answer = ""
 
             while retry_count < self.max_retry:
                 try:
-                    answer, duration_llm = await self.llm_new(user_query=req.query, history_context=context, platform=req.platform, status=status, helpdesk_active_status=helpdesk_active_status, context_docs=reranked)
+                    if get_stream_sink() is not None:
+                        answer, duration_llm = await self.generate_streamed_answer(req=req, context=context, status=status, helpdesk_active_status=helpdesk_active_status, context_docs=reranked)
+                    else:
+                        answer, duration_llm = await self.llm_new(user_query=req.query, history_context=context, platform=req.platform, status=status, helpdesk_active_status=helpdesk_active_status, context_docs=reranked)
                 except asyncio.TimeoutError:
                     print("[ERROR] generate_answer timeout")
-                    is_answered=None
-                    answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-                    question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-                    await self.repository.flag_message_cannot_answer_by_id(question_id)
-                    await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-                    return_data = FinalResponse(
-                        conversation_id=ret_conversation_id,
-                        rewritten_query=rewritten,
-                        category=collection_choice,
-                        question_category=None,
-                        answer=answer,
-                        question_id=question_id,
-                        answer_id=answer_id,
-                        citations=[],
-                        is_answered=False,
-                        is_faq=False
-                    )
-
-                    return JSONResponse(
-                            status_code=504,
-                            content=self._build_final_response(req=req, data=return_data)
-                    )
-
+                    return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, category=collection_choice, status_code=504)
+                except InferenceQueueFull as e:
+                    print(f"[ERROR] generate_answer rejected: {e}")
+                    return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, category=collection_choice, status_code=503)
                 except Exception as e:
                     print(f"[ERROR] generate_answer failed: {e}")
-                    is_answered=None
-                    answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-                    question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-                    await self.repository.flag_message_cannot_answer_by_id(question_id)
-                    await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-                    return_data = FinalResponse(
-                        conversation_id=ret_conversation_id,
-                        rewritten_query=rewritten,
-                        category=collection_choice,
-                        question_category=None,
-                        answer=answer,
-                        question_id=question_id,
-                        answer_id=answer_id,
-                        citations=[],
-                        is_answered=False,
-                        is_faq=False
-                    )
-
-                    return JSONResponse(
-                            status_code=500,
-                            content=self._build_final_response(req=req, data=return_data)
-                    )
-    
+                    return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, category=collection_choice, status_code=500)
+
                 if not answer or not answer.strip(): # if answer "", " ", or None, means LLM error, timeout, etc
                     print(f"[WARN] Empty answer (retry {retry_count}/{self.max_retry})")
                     retry_count += 1
+                    # tokens of the rejected attempt were already streamed, the client must discard them
+                    emit_event("reset", {"reason": "empty", "attempt": retry_count})
                     continue
 
                 if self.is_repeating_answer(answer):
                     print(f"[WARN] Repeating answer (retry {retry_count}/{self.max_retry})")
                     retry_count += 1
+                    # tokens of the rejected attempt were already streamed, the client must discard them
+                    emit_event("reset", {"reason": "repeating", "attempt": retry_count})
                     continue
 
                 break
@@ -432,14 +458,20 @@ class ChatflowHandler:
             if not answer or self.is_repeating_answer(answer):
                 print("[ERROR] Repeating answer persists, using fallback template")
                 answer = "Mohon maaf, saat ini sedang terjadi kendala pada sistem kami. Silakan coba kembali beberapa saat lagi."
-            
-        question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
+                emit_event("token", {"text": answer})
+
+        emit_event("answer", {
+            "conversation_id": ret_conversation_id,
+            "rewritten_query": rewritten,
+            "category": collection_choice,
+            "answer": self.build_display_answer(answer, initial_message),
+            "citations": citations,
+        })
         print("Exiting handle_full_retrieval method")
-        return answer, citations, question_id, answer_id, duration, duration_rerank, duration_llm, duration_classify_kbli, duration_classify_specific
+        return answer, citations, duration, duration_rerank, duration_llm, duration_classify_kbli, duration_classify_specific
     
     async def handle_failed_answer_from_llm(self, req: ChatRequest, helpdesk_active_status: bool, ret_conversation_id: str, rewritten:str, initial_message: str, category: str, q_category: Tuple, answer: str, question_id: str, answer_id: str):
         print("Entering handle_failed_answer_from_llm method")
-        await self.repository.flag_message_cannot_answer_by_id(question_id)
         ask_helpdesk = False
         if (answer.startswith('Mohon maaf, pertanyaan tersebut belum bisa kami jawab.')) and helpdesk_active_status:
             await self.repository.change_is_ask_helpdesk_status(ret_conversation_id)
@@ -459,17 +491,15 @@ class ChatflowHandler:
             req=req,
             data=return_data)
     
-    async def check_existing_helpdesk_flow(self, req: ChatRequest):
+    async def check_existing_helpdesk_flow(self, req: ChatRequest, state: ConversationState):
         print("Entering check_existing_helpdesk_flow method")
         if req.conversation_id == "":
             return None
 
-        ask_status = await self.repository.check_is_ask_helpdesk(req.conversation_id)
-        if ask_status:
+        if state.is_ask_helpdesk:
             return await self.handle_helpdesk_confirmation_answer(req=req)
 
-        helpdesk_status = await self.repository.check_is_helpdesk(req.conversation_id)
-        if helpdesk_status:
+        if state.is_helpdesk:
             return FinalResponse(
                 conversation_id=req.conversation_id,
                 answer="Percakapan telah dipindahkan ke helpdesk.",
@@ -492,18 +522,253 @@ class ChatflowHandler:
 
         return query
     
+    def get_answer_format(self, platform: str) -> str:
+        return "plain" if platform.lower() in ["instagram", "email", "whatsapp"] else "markdown"
+
+    def is_cacheable_answer(self, rewritten: str, answer: str) -> bool:
+        if not answer or not answer.strip():
+            return False
+        if is_kbli_query(rewritten):
+            return False
+        return not (answer.startswith("Mohon maaf") or answer.startswith("Informasi untuk kode KBLI"))
+
+    async def get_query_vectors(self, rewritten: str):
+        try:
+            return await self.query_embedder(rewritten)
+        except Exception as e:
+            print(f"[WARN] Query embedding failed: {e}")
+            return None
+
+    async def lookup_cached_answer(self, rewritten: str, collection_choice: str, answer_format: str, query_vectors=None):
+        print("Entering lookup_cached_answer method")
+        if not self.answer_cache.enabled or is_kbli_query(rewritten):
+            return None, query_vectors
+
+        cached = self.answer_cache.get_exact(rewritten, collection_choice, answer_format)
+        if cached is not None:
+            return cached, query_vectors
+
+        if query_vectors is None:
+            query_vectors = await self.get_query_vectors(rewritten)
+        if query_vectors is not None:
+            cached = self.answer_cache.get_similar(query_vectors.dense, rewritten, collection_choice, answer_format)
+        print("Exiting lookup_cached_answer method")
+        return cached, query_vectors
+
+    async def handle_cached_answer(self, req: ChatRequest, ret_conversation_id: str, rewritten: str, initial_message: str, collection_choice: str, cached: dict, durations: dict):
+        print("Entering handle_cached_answer method")
+        answer = cached["answer"]
+        citations = cached["citations"]
+        question_classify = cached["question_category"]
+
+        turn = ChatTurnRecord(ret_conversation_id, req.query, answer, rewritten)
+        turn.flag_answered(False)
+        turn.set_start_timestamp(req.start_timestamp)
+        category = turn.set_category(collection_choice)
+        turn.set_citations(citations)
+        ledger = get_ledger()
+        turn.set_durations(llm_call_count=ledger.total_calls, llm_token_count=ledger.total_tokens, **durations)
+        if question_classify:
+            q_category = turn.set_question_category(question_classify.get("category"), question_classify.get("sub_category"))
+            question_id, answer_id = await self.repository.persist_turn(turn)
+        else:
+            # the entry was cached before its own enrichment finished
+            q_category = None
+            question_id, answer_id = await self.repository.persist_turn(
+                turn,
+                on_saved=lambda question_id, answer_id: self.submit_question_enrichment(question_id, rewritten)
+            )
+
+        print("Exiting handle_cached_answer method")
+        return_data = FinalResponse(
+            conversation_id=ret_conversation_id,
+            rewritten_query=rewritten,
+            category=category,
+            question_category=q_category,
+            answer=self.build_display_answer(answer, initial_message),
+            question_id=question_id,
+            answer_id=answer_id,
+            citations=citations,
+            is_answered=False,
+            is_faq=False,
+            is_cached=True
+        )
+        return self._build_final_response(
+            req=req,
+            data=return_data)
+
+    def submit_question_enrichment(self, question_id: int, rewritten: str, cache_key: tuple = None):
+        if not question_id:
+            print("[WARN] Skipping question classification, question id is not known yet")
+            return
+        self.enrichment.submit("classify_user_query", self.enrich_question_category, question_id, rewritten, cache_key)
+
+    async def enrich_question_category(self, question_id: int, rewritten: str, cache_key: tuple = None, final_attempt: bool = False):
+        start = time.perf_counter()
+        question_classify = await self.question_classifier(rewritten)
+        if question_classify.get("category") == "Unknown" and not final_attempt:
+            raise EnrichmentRetry(f"classify_user_query returned Unknown for question {question_id}")
+        duration = time.perf_counter() - start
+
+        await self.repository.ingest_question_category(
+            question_id,
+            question_classify.get("category"),
+            question_classify.get("sub_category")
+        )
+        await self.repository.ingest_question_classifier_duration(question_id, duration)
+        if cache_key is not None:
+            self.answer_cache.set_question_category(*cache_key, question_classify)
+
+    async def handle_pipeline_error(self, req: ChatRequest, ret_conversation_id: str, rewritten: str, category: str, status_code: int):
+        print("Entering handle_pipeline_error method")
+        is_answered=None
+        answer = self.overload_message
+        question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
+        await self.repository.flag_message_cannot_answer_by_id(ret_conversation_id, question_id)
+        await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
+        return_data = FinalResponse(
+            conversation_id=ret_conversation_id,
+            rewritten_query=rewritten or "",
+            category=category,
+            question_category=None,
+            answer=answer,
+            question_id=question_id,
+            answer_id=answer_id,
+            citations=[],
+            is_answered=False,
+            is_faq=False
+        )
+        print("Exiting handle_pipeline_error method")
+        return JSONResponse(
+                status_code=status_code,
+                content=self._build_final_response(req=req, data=return_data)
+        )
+
+    def handle_overload(self, req: ChatRequest):
+        # shed before any LLM or DB work, so nothing is persisted for this message
+        return_data = FinalResponse(
+            conversation_id=req.conversation_id,
+            answer=self.overload_message,
+            citations=[],
+            is_answered=False,
+            is_faq=False
+        )
+        return JSONResponse(
+                status_code=503,
+                content=self._build_final_response(req=req, data=return_data)
+        )
+
+    async def _timed_stage(self, name: str, coro, timings: dict):
+        start = time.perf_counter()
+        try:
+            return await coro, None
+        except asyncio.CancelledError:
+            print(f"[INFO] Stage {name} cancelled")
+            raise
+        except Exception as e:
+            return None, e
+        finally:
+            timings[name] = time.perf_counter() - start
+
+    async def _speculative_faq(self, rewrite_task: asyncio.Task, timings: dict):
+        rewritten, error = await rewrite_task
+        if error is not None or not rewritten:
+            return None
+        result, error = await self._timed_stage("faq_speculative", self.retrieve_faq(rewritten), timings)
+        if error is not None:
+            print(f"[WARN] Speculative FAQ retrieval failed: {error}")
+            return None
+        return result
+
+    async def run_pipeline_stages(self, req: ChatRequest, context: str):
+        print("Entering run_pipeline_stages method")
+        timings = {}
+        stages = {
+            "rewritten": None,
+            "rewriter_error": None,
+            "collection_choice": None,
+            "classifier_error": None,
+            "faq": None,
+            "timings": timings,
+        }
+
+        if not self.speculative_pipeline:
+            stages["rewritten"], stages["rewriter_error"] = await self._timed_stage("rewriter", self.rewriter(user_query=req.query, history_context=context), timings)
+            if stages["rewriter_error"] is None:
+                stages["collection_choice"], stages["classifier_error"] = await self._timed_stage("classify_collection", self.classifier(req.query, context), timings)
+            print(f"[INFO] Stage timings: {timings}")
+            print("Exiting run_pipeline_stages method")
+            return stages
+
+        start = time.perf_counter()
+        async with asyncio.TaskGroup() as tg:
+            rewrite_task = tg.create_task(self._timed_stage("rewriter", self.rewriter(user_query=req.query, history_context=context), timings))
+            classify_task = tg.create_task(self._timed_stage("classify_collection", self.classifier(req.query, context), timings))
+            faq_task = tg.create_task(self._speculative_faq(rewrite_task, timings))
+
+            stages["rewritten"], stages["rewriter_error"] = await rewrite_task
+            if stages["rewriter_error"] is not None:
+                classify_task.cancel()
+                faq_task.cancel()
+            else:
+                stages["collection_choice"], stages["classifier_error"] = await classify_task
+                if stages["classifier_error"] is not None or stages["collection_choice"] in self.no_retrieval_choices:
+                    print(f"[INFO] Cancelling speculative FAQ branch, classifier result: {stages['collection_choice']}")
+                    faq_task.cancel()
+
+        if not faq_task.cancelled():
+            stages["faq"] = faq_task.result()
+        timings["pipeline_total"] = time.perf_counter() - start
+        print(f"[INFO] Stage timings: {timings}")
+        print("Exiting run_pipeline_stages method")
+        return stages
+
     async def chatflow_call(self, req: ChatRequest):
+        ledger = InferenceLedger()
+        token = current_ledger.set(ledger)
+        budget_token = start_request_budget()
+        conversation_token = current_conversation.set(req.conversation_id or req.platform_unique_id)
+        try:
+            return await self.run_chatflow(req)
+        finally:
+            print(f"[INFO] Inference ledger: {ledger.summary()}")
+            current_conversation.reset(conversation_token)
+            reset_request_budget(budget_token)
+            current_ledger.reset(token)
+
+    async def chatflow_stream_call(self, req: ChatRequest, sink: StreamSink):
+        token = current_stream_sink.set(sink)
+        try:
+            result = await self.chatflow_call(req)
+            if isinstance(result, JSONResponse):
+                sink.emit("done", {"status_code": result.status_code, **json.loads(result.body)})
+            elif isinstance(result, dict):
+                sink.emit("done", {"status_code": 200, **result})
+            else:
+                sink.emit("done", {"status_code": 200, **result.model_dump()})
+        except asyncio.CancelledError:
+            # shutdown cancelled the chatflow, end the client's stream instead of leaving it open
+            sink.emit("error", {"message": self.overload_message})
+            raise
+        except Exception as e:
+            print(f"[ERROR] chatflow_stream_call failed: {e}")
+            sink.emit("error", {"message": self.overload_message})
+        finally:
+            current_stream_sink.reset(token)
+
+    async def run_chatflow(self, req: ChatRequest):
         print("Entering chatflow_call method")
         helpdesk_active_status = await self.repository.check_helpdesk_activation()
         print("Helpdesk Status: " + str(helpdesk_active_status))
-        helpdesk_result = await self.check_existing_helpdesk_flow(req)
+        state = await self.repository.load_conversation_state(req.conversation_id)
+        helpdesk_result = await self.check_existing_helpdesk_flow(req, state)
         if helpdesk_result:
             return self._build_final_response(req=req, data=helpdesk_result)
             
         start_timestamp = req.start_timestamp
         ret_conversation_id = req.conversation_id
         initial_message = ""
-        context = await self.repository.get_context(ret_conversation_id)
+        context = state.context()
 
         if context == "Conversation History:":
             if ret_conversation_id == "":
@@ -511,137 +776,52 @@ class ChatflowHandler:
             await self.repository.create_new_conversation(ret_conversation_id, req.platform, req.platform_unique_id)
             initial_message = await self.get_greetings_message()
 
-        start_rewriter = time.perf_counter()
-        
-        try:
-            rewritten= await self.rewriter(user_query=req.query, history_context=context)
-        except asyncio.TimeoutError:
-            print("[ERROR] rewrite_query timeout")
-            is_answered=None
-            answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-            rewritten=None
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_cannot_answer_by_id(question_id)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-            return_data = FinalResponse(
-                conversation_id=ret_conversation_id,
-                rewritten_query="",
-                category="",
-                question_category=None,
-                answer=answer,
-                question_id=question_id,
-                answer_id=answer_id,
-                citations=[],
-                is_answered=False,
-                is_faq=False
-            )
+        stages = await self.run_pipeline_stages(req=req, context=context)
+        timings = stages["timings"]
+        rewritten = stages["rewritten"]
+        collection_choice = stages["collection_choice"]
+        duration_rewriter = timings.get("rewriter", 0)
+        duration_classify_col = timings.get("classify_collection", 0)
+
+        if stages["rewriter_error"] is not None:
+            error = stages["rewriter_error"]
+            if isinstance(error, asyncio.TimeoutError):
+                print("[ERROR] rewrite_query timeout")
+                return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=None, category="", status_code=504)
+            if isinstance(error, InferenceQueueFull):
+                print(f"[ERROR] rewrite_query rejected: {error}")
+                return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=None, category="", status_code=503)
+            print(f"[ERROR] rewrite_query failed: {error}")
+            return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=None, category="", status_code=500)
 
-            return JSONResponse(
-                    status_code=504,
-                    content=self._build_final_response(req=req, data=return_data)
-            )
-        except Exception as e:
-            print(f"[ERROR] rewrite_query failed: {e}")
-            answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-            rewritten=None
-            is_answered=None
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_cannot_answer_by_id(question_id)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-            return_data = FinalResponse(
-                conversation_id=ret_conversation_id,
-                rewritten_query="",
-                category="",
-                question_category=None,
-                answer=answer,
-                question_id=question_id,
-                answer_id=answer_id,
-                citations=[],
-                is_answered=False,
-                is_faq=False
-            )
-            return JSONResponse(
-                    status_code=500,
-                    content=self._build_final_response(req=req, data=return_data)
-            )
-        
-        end_rewriter = time.perf_counter()
-        duration_rewriter = end_rewriter - start_rewriter
         await self.repository.give_conversation_title(session_id=ret_conversation_id, rewritten=rewritten)
-
-        start_classify_col = time.perf_counter()
-        collection_choice = await self.classifier(req.query, context)
-
-        try:
-            collection_choice = await self.classifier(req.query, context)
-        except asyncio.TimeoutError:
-            print("[ERROR] classify_collection timeout")
-            is_answered=None
-            answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_cannot_answer_by_id(question_id)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-            return_data = FinalResponse(
-                conversation_id=ret_conversation_id,
-                rewritten_query=rewritten,
-                category="",
-                question_category=None,
-                answer=answer,
-                question_id=question_id,
-                answer_id=answer_id,
-                citations=[],
-                is_answered=False,
-                is_faq=False
-            )
-
-            return JSONResponse(
-                    status_code=504,
-                    content=self._build_final_response(req=req, data=return_data)
-            )
-
-        except Exception as e:
-            print(f"[ERROR] classify_collection failed: {e}")
-            is_answered=None
-            answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_cannot_answer_by_id(question_id)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-            return_data = FinalResponse(
-                conversation_id=ret_conversation_id,
-                rewritten_query=rewritten,
-                category="",
-                question_category=None,
-                answer=answer,
-                question_id=question_id,
-                answer_id=answer_id,
-                citations=[],
-                is_answered=False,
-                is_faq=False
-            )
-
-            return JSONResponse(
-                    status_code=500,
-                    content=self._build_final_response(req=req, data=return_data)
-            )
-    
-
-        end_classify_col = time.perf_counter()
-        duration_classify_col = end_classify_col - start_classify_col
+        emit_event("rewritten", {"rewritten_query": rewritten})
+
+        if stages["classifier_error"] is not None:
+            error = stages["classifier_error"]
+            if isinstance(error, asyncio.TimeoutError):
+                print("[ERROR] classify_collection timeout")
+                return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, category="", status_code=504)
+            if isinstance(error, InferenceQueueFull):
+                print(f"[ERROR] classify_collection rejected: {error}")
+                return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, category="", status_code=503)
+            print(f"[ERROR] classify_collection failed: {error}")
+            return await self.handle_pipeline_error(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, category="", status_code=500)
 
         if collection_choice == "uraian_collection":
             collection_choice = "peraturan_collection"
 
         rewritten=self.rewrite_query_if_masterlist(rewritten, collection_choice)
+        emit_event("category", {"category": collection_choice})
 
         if collection_choice == "helpdesk":
             return await self.handle_helpdesk_response(helpdesk_active_status=helpdesk_active_status, req=req, ret_conversation_id=ret_conversation_id, initial_message=initial_message, rewritten=rewritten, start_timestamp=req.start_timestamp)
         
         if collection_choice == "skip_collection_check" or collection_choice == "greeting_query" or collection_choice == "thank_you" or collection_choice == "classified_information":
-            return await self.handle_default_answering(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, collection_choice=collection_choice)
+            return await self.handle_default_answering(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, collection_choice=collection_choice, state=state)
         
-        status = await self.repository.check_fail_history(ret_conversation_id)
-        question_id = 0
-        answer_id = 0
+        answer_format = self.get_answer_format(req.platform)
+        status = state.has_fail_streak()
         is_faq=False
         qdrant_duration_1 = 0
         qdrant_duration_2 = 0
@@ -649,98 +829,84 @@ class ChatflowHandler:
         llm_duration = 0
         duration_classify_kbli = 0
         duration_classify_specific = 0
-        duration_q_classifier = 0
-        faq_response, qdrant_duration_1 = await self.retrieve_faq(rewritten)
+        query_vectors = None
+        speculative_faq = stages["faq"]
+        if speculative_faq is not None and rewritten == stages["rewritten"]:
+            print("[INFO] Using speculative FAQ result")
+            faq_response, qdrant_duration_1 = speculative_faq
+        else:
+            if not is_kbli_query(rewritten):
+                query_vectors = await self.get_query_vectors(rewritten)
+            faq_response, qdrant_duration_1 = await self.retrieve_faq(rewritten, query_vectors)
         faq_answer = faq_response["answer"]
+        faq_matched = faq_response["matched"] and isinstance(faq_answer, str) and faq_answer.strip()
+
+        # the answer cache is only consulted on a FAQ miss, so an added or revised FAQ wins right away
+        if not faq_matched:
+            cached, query_vectors = await self.lookup_cached_answer(rewritten, collection_choice, answer_format, query_vectors)
+            if cached is not None:
+                durations = {"qdrant_duration_1": qdrant_duration_1, "rewrite_duration": duration_rewriter, "classify_col_duration": duration_classify_col}
+                return await self.handle_cached_answer(req=req, ret_conversation_id=ret_conversation_id, rewritten=rewritten, initial_message=initial_message, collection_choice=collection_choice, cached=cached, durations=durations)
 
-        if faq_response["matched"] and isinstance(faq_answer, str) and faq_answer.strip():
+        if faq_matched:
             citations = faq_response["citations"]
             answer = faq_answer
             is_answered=True
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
             is_faq=True
         else:
             is_answered=False
-            answer, citations, question_id, answer_id, qdrant_duration_2, rerank_duration, llm_duration, duration_classify_kbli, duration_classify_specific = await self.handle_full_retrieval(req=req, ret_conversation_id=ret_conversation_id, status=status, helpdesk_active_status=helpdesk_active_status, context=context, rewritten=rewritten, collection_choice=collection_choice)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-
-        await self.repository.ingest_start_timestamp(start_timestamp, question_id, answer_id)
-        category = await self.repository.ingest_category(question_id, collection_choice)
-        start_q_classifier = time.perf_counter()
-        try:
-            question_classify = await self.question_classifier(rewritten)
-        except asyncio.TimeoutError:
-            print("[ERROR] classify_user_query timeout")
-            is_answered=None
-            answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_cannot_answer_by_id(question_id)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-            return_data = FinalResponse(
-                conversation_id=ret_conversation_id,
-                rewritten_query=rewritten,
-                category=collection_choice,
-                question_category=None,
-                answer=answer,
-                question_id=question_id,
-                answer_id=answer_id,
-                citations=[],
-                is_answered=False,
-                is_faq=False
-            )
-
-            return JSONResponse(
-                    status_code=504,
-                    content=self._build_final_response(req=req, data=return_data)
-            )
-
-        except Exception as e:
-            print(f"[ERROR] classify_user_query failed: {e}")
-            is_answered=None
-            answer = "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-            question_id, answer_id = await self.repository.insert_skip_chat(ret_conversation_id, req.query, answer, rewritten)
-            await self.repository.flag_message_cannot_answer_by_id(question_id)
-            await self.repository.flag_message_is_answered(question_id, answer_id, is_answered)
-            return_data = FinalResponse(
-                conversation_id=ret_conversation_id,
-                rewritten_query=rewritten,
-                category=collection_choice,
-                question_category=None,
-                answer=answer,
-                question_id=question_id,
-                answer_id=answer_id,
-                citations=[],
-                is_answered=False,
-                is_faq=False
-            )
-
-            return JSONResponse(
-                    status_code=500,
-                    content=self._build_final_response(req=req, data=return_data)
-            )
-    
-        end_q_classifier = time.perf_counter()
-        duration_q_classifier = end_q_classifier - start_q_classifier
-        await self.repository.insert_durations(question_id, answer_id, qdrant_duration_1, qdrant_duration_2, rerank_duration, llm_duration, duration_rewriter, duration_classify_col, duration_q_classifier, duration_classify_kbli, duration_classify_specific)
-        q_category = await self.repository.ingest_question_category(
-            question_id,
-            question_classify.get("category"),
-            question_classify.get("sub_category")
+            retrieval_result = await self.handle_full_retrieval(req=req, ret_conversation_id=ret_conversation_id, status=status, helpdesk_active_status=helpdesk_active_status, context=context, rewritten=rewritten, collection_choice=collection_choice, query_vectors=query_vectors, initial_message=initial_message, asked_kbli_codes=state.asked_kbli_codes)
+            if isinstance(retrieval_result, JSONResponse):
+                return retrieval_result
+            answer, citations, qdrant_duration_2, rerank_duration, llm_duration, duration_classify_kbli, duration_classify_specific = retrieval_result
+
+        # all writes for this turn are collected here and flushed in one statement
+        turn = ChatTurnRecord(ret_conversation_id, req.query, answer, rewritten)
+        turn.flag_answered(is_answered)
+        turn.set_start_timestamp(start_timestamp)
+        category = turn.set_category(collection_choice)
+        ledger = get_ledger()
+        turn.set_durations(
+            qdrant_duration_1=qdrant_duration_1,
+            qdrant_duration_2=qdrant_duration_2,
+            rerank_duration=rerank_duration,
+            llm_duration=llm_duration,
+            rewrite_duration=duration_rewriter,
+            classify_col_duration=duration_classify_col,
+            kbli_duration=duration_classify_kbli,
+            specific_duration=duration_classify_specific,
+            llm_call_count=ledger.total_calls,
+            llm_token_count=ledger.total_tokens
         )
+        # question category is filled in later by the enrichment pool
+        q_category = None
         print("Exiting chatflow_call method")
 
-        if(answer.startswith('Mohon maaf, apakah Bapak/Ibu bisa tanyakan dengan lebih detail dan jelas?')) or (answer.startswith('Mohon maaf, pertanyaan tersebut belum bisa kami jawab.')):
+        if self.is_failed_answer(answer):
+            turn.flag_cannot_answer()
+            question_id, answer_id = await self.repository.persist_turn(
+                turn,
+                on_saved=lambda question_id, answer_id: self.submit_question_enrichment(question_id, rewritten)
+            )
             return await self.handle_failed_answer_from_llm(req=req, helpdesk_active_status=helpdesk_active_status, ret_conversation_id=ret_conversation_id, rewritten=rewritten, initial_message=initial_message, category=category, q_category=q_category, answer=answer, question_id=question_id, answer_id=answer_id)
         
-        await self.repository.ingest_citations(citations, question_id)
+        turn.set_citations(citations)
+
+        cache_key = None
+        if not is_faq and self.is_cacheable_answer(rewritten, answer):
+            self.answer_cache.put(rewritten, collection_choice, answer_format, answer, citations, None, query_vectors.dense if query_vectors else None)
+            cache_key = (rewritten, collection_choice, answer_format)
+        question_id, answer_id = await self.repository.persist_turn(
+            turn,
+            on_saved=lambda question_id, answer_id: self.submit_question_enrichment(question_id, rewritten, cache_key)
+        )
 
         return_data = FinalResponse(
             conversation_id=ret_conversation_id,
             rewritten_query=rewritten,
             category=category,
             question_category=q_category,
-            answer=(initial_message or "") + answer + "\n\n*Jawaban dibuat oleh AI, bukan sebagai referensi pendapat hukum dan tidak selalu akurat. Mohon lakukan pengecekan tambahan atau lebih detil bila diperlukan.*",
+            answer=self.build_display_answer(answer, initial_message),
             question_id=question_id,
             answer_id=answer_id,
             citations=citations,
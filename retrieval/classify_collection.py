@@ -2,7 +2,7 @@ import os
 from dotenv import load_dotenv
 from util.async_ollama import ollama_chat_async
 from util.sanitize_input import sanitize_input
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
 
 load_dotenv()
 
@@ -97,7 +97,7 @@ Additional instructions:
 """
 
 async def classify_collection(user_query: str, history_context: str) -> str:
-    async with ollama_semaphore:
+    async with inference_scheduler.slot("classification", model_name):
       print("Entering classify_collection method")
       safe_query = sanitize_input(user_query)
       safe_history = sanitize_input(history_context)
@@ -114,6 +114,7 @@ async def classify_collection(user_query: str, history_context: str) -> str:
       </query>
       """
       response = await ollama_chat_async(
+         stage="classify_collection",
          model=model_name,
          messages=[
                # {"role": "system", "content": prompt},
@@ -1,7 +1,7 @@
 import os
 from dotenv import load_dotenv
 from util.async_ollama import ollama_chat_async
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
 
 load_dotenv()
 
@@ -85,7 +85,7 @@ Output:
 """
 
 async def classify_kbli(user_query: str, history_context: str) -> str:
-    async with ollama_semaphore:
+    async with inference_scheduler.slot("classification", model_name):
         print("Entering classify_kbli method")
         user_content = f"""
         {prompt}
@@ -101,6 +101,7 @@ async def classify_kbli(user_query: str, history_context: str) -> str:
 
         try:
             response = await ollama_chat_async(
+                stage="classify_kbli",
                 model=model_name,
                 messages=[
                     # {"role": "system", "content": prompt},
@@ -1,7 +1,7 @@
 import os
 from dotenv import load_dotenv
 from util.async_ollama import ollama_chat_async
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
 
 load_dotenv()
 
@@ -42,7 +42,7 @@ NOTE: You will receive <context> which is the chat history between you and this
 """
 
 async def classify_specific(user_query: str, history_context: str) -> str:
-    async with ollama_semaphore:
+    async with inference_scheduler.slot("classification", model_name):
         print("Entering classify_specific method")
         user_content = f"""
         {prompt}
@@ -58,6 +58,7 @@ async def classify_specific(user_query: str, history_context: str) -> str:
 
         try:
             response = await ollama_chat_async(
+                stage="classify_specific",
                 model=model_name,
                 messages=[
                     # {"role": "system", "content": prompt},
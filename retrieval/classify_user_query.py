@@ -5,7 +5,8 @@ import requests
 from dotenv import load_dotenv
 from util.db_connection import get_pool
 from util.async_ollama import ollama_chat_async
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
+from util.config_cache import config_cache
 
 load_dotenv()
 
@@ -36,13 +37,9 @@ async def load_classifications_from_db():
 
     return categories
 
-async def classify_user_query(user_query: str) -> dict:
-    print("Entering classify_user_query...")
-
-    categories = await load_classifications_from_db()
+def build_system_prompt(categories: dict) -> str:
     categories_json = json.dumps(categories, ensure_ascii=False, indent=2)
 
-   
     system_prompt = f"""
     You are a classification assistant for BKPM Indonesia's OSS system.
 
@@ -63,6 +60,24 @@ async def classify_user_query(user_query: str) -> dict:
     AVAILABLE_CATEGORIES:
     {categories_json}
     """
+    return system_prompt
+
+async def load_classification_prompt():
+    categories = await load_classifications_from_db()
+    print(f"Loaded {sum(len(subs) for subs in categories.values())} user query classifications")
+    return {"categories": categories, "prompt": build_system_prompt(categories)}
+
+# taxonomy and its prompt block are built once and dropped on TTL or NOTIFY config_cache, 'user_query_classifications'
+config_cache.register("user_query_classifications", load_classification_prompt)
+
+async def reload_classifications() -> dict:
+    config_cache.invalidate("user_query_classifications")
+    return (await config_cache.get("user_query_classifications"))["categories"]
+
+async def classify_user_query(user_query: str) -> dict:
+    print("Entering classify_user_query...")
+
+    system_prompt = (await config_cache.get("user_query_classifications"))["prompt"]
 
     user_prompt = f"""
     {system_prompt}
@@ -72,9 +87,10 @@ async def classify_user_query(user_query: str) -> dict:
     Remember: Output ONLY the JSON object, use EXACT category names from the list.
     """
 
-    async with ollama_semaphore:
+    async with inference_scheduler.slot("enrichment", model_name):
         try:
             response = await ollama_chat_async(
+                stage="classify_user_query",
                 model=model_name,
                 messages=[
                     # {"role": "system", "content": system_prompt},
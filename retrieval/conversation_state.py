@@ -0,0 +1,132 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONVERSATION_STATE_CACHE_SIZE = int(os.getenv("CONVERSATION_STATE_CACHE_SIZE", "2000"))
+# flags can also be flipped by the helpdesk dashboard, so cached state is only trusted this long
+CONVERSATION_STATE_TTL = float(os.getenv("CONVERSATION_STATE_TTL", "30"))
+
+HISTORY_LIMIT = 6
+FAIL_HISTORY_LIMIT = 4
+
+AUTO_ERROR_MESSAGE = (
+    "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
+)
+
+KBLI_CODE_PATTERN = re.compile(r"\b\d{5}\b")
+
+def extract_kbli_codes(text: str) -> list[str]:
+    return KBLI_CODE_PATTERN.findall(text or "")
+
+def build_context(rows: list) -> str:
+    context_parts = ["Conversation History:"]
+    for i, row in enumerate(rows):
+        if row["type"] == "ai" and row["content"] and AUTO_ERROR_MESSAGE in row["content"]:
+            continue
+
+        block = f"""
+            {i + 1}. type: {row['type']}
+            content: {row['content']}
+            """
+        context_parts.append(block)
+    history_string = "\n".join(context_parts)
+    return history_string.strip()
+
+class ConversationState:
+    def __init__(self, session_id: str, exists: bool = False, is_helpdesk: bool = False, is_ask_helpdesk: bool = False, history: list = None, fail_history: list = None, asked_kbli_codes: set = None):
+        self.session_id = session_id
+        self.exists = exists
+        self.is_helpdesk = is_helpdesk
+        self.is_ask_helpdesk = is_ask_helpdesk
+        # oldest first, at most HISTORY_LIMIT rows of {"type", "content"}
+        self.history = history or []
+        # newest first, at most FAIL_HISTORY_LIMIT rows of {"id", "is_cannot_answer"}
+        self.fail_history = fail_history or []
+        self.asked_kbli_codes = asked_kbli_codes or set()
+        self.loaded_at = time.monotonic()
+
+    def copy(self):
+        state = ConversationState(
+            self.session_id,
+            exists=self.exists,
+            is_helpdesk=self.is_helpdesk,
+            is_ask_helpdesk=self.is_ask_helpdesk,
+            history=list(self.history),
+            fail_history=[dict(row) for row in self.fail_history],
+            asked_kbli_codes=set(self.asked_kbli_codes),
+        )
+        state.loaded_at = self.loaded_at
+        return state
+
+    def context(self) -> str:
+        return build_context(self.history)
+
+    def has_fail_streak(self) -> bool:
+        values = [row["is_cannot_answer"] for row in self.fail_history]
+        return len(values) == FAIL_HISTORY_LIMIT and all(val is True for val in values)
+
+    def append_turn(self, question_id: int, human_message: str, ai_message: str, rewritten: str = "", is_cannot_answer=None):
+        self.history.extend([
+            {"type": "human", "content": human_message},
+            {"type": "ai", "content": ai_message},
+        ])
+        self.history = self.history[-HISTORY_LIMIT:]
+        fail_row = {"id": question_id, "is_cannot_answer": is_cannot_answer}
+        self.fail_history.insert(0, fail_row)
+        self.fail_history = self.fail_history[:FAIL_HISTORY_LIMIT]
+        self.asked_kbli_codes.update(extract_kbli_codes(rewritten))
+        return fail_row
+
+class ConversationStateCache:
+    """
+    The cached states are shared by every request of a conversation. get() hands out a copy;
+    the cached object itself is only changed through peek() by the repository, in code
+    that does not await in between.
+    """
+
+    def __init__(self, max_size: int = CONVERSATION_STATE_CACHE_SIZE, ttl: float = CONVERSATION_STATE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.states = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, session_id: str):
+        state = self.states.get(session_id)
+        if state is None or time.monotonic() - state.loaded_at > self.ttl:
+            self.states.pop(session_id, None)
+            self.stats["misses"] += 1
+            return None
+        self.states.move_to_end(session_id)
+        self.stats["hits"] += 1
+        return state.copy()
+
+    def peek(self, session_id: str):
+        return self.states.get(session_id)
+
+    def put(self, state: ConversationState):
+        self.states[state.session_id] = state
+        self.states.move_to_end(state.session_id)
+        while len(self.states) > self.max_size:
+            self.states.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, session_id: str):
+        self.states.pop(session_id, None)
+
+    def flag_cannot_answer(self, session_id: str, question_id: int):
+        state = self.states.get(session_id)
+        if state is None:
+            return
+        for row in state.fail_history:
+            if row["id"] == question_id:
+                row["is_cannot_answer"] = True
+                return
+
+    def report(self) -> dict:
+        return {"size": len(self.states), **self.stats}
+
+conversation_state_cache = ConversationStateCache()
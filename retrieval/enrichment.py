@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+from dotenv import load_dotenv
+
+load_dotenv()
+
+ENRICHMENT_WORKERS = int(os.getenv("ENRICHMENT_WORKERS", "2"))
+ENRICHMENT_MAX_QUEUE = int(os.getenv("ENRICHMENT_MAX_QUEUE", "1000"))
+ENRICHMENT_MAX_RETRIES = int(os.getenv("ENRICHMENT_MAX_RETRIES", "3"))
+ENRICHMENT_RETRY_DELAY = float(os.getenv("ENRICHMENT_RETRY_DELAY", "2"))
+
+class EnrichmentRetry(Exception):
+    """Raised by a job to ask for another attempt."""
+
+class EnrichmentPool:
+    """Runs post-answer jobs (e.g. question classification) outside the request path."""
+
+    def __init__(self, workers: int = ENRICHMENT_WORKERS, max_queue: int = ENRICHMENT_MAX_QUEUE, max_retries: int = ENRICHMENT_MAX_RETRIES, retry_delay: float = ENRICHMENT_RETRY_DELAY):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.queue = None
+        self.tasks = []
+        self.retry_handles = set()
+        self.stats = {"submitted": 0, "completed": 0, "retried": 0, "failed": 0, "rejected": 0, "busy": 0, "last_duration": 0.0}
+        print("EnrichmentPool initialized")
+
+    async def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        print(f"EnrichmentPool started with {self.workers} workers")
+
+    async def stop(self, timeout: float = 30):
+        if not self.tasks:
+            return
+        for handle in self.retry_handles:
+            handle.cancel()
+        self.retry_handles.clear()
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            print(f"[WARN] EnrichmentPool stopping with {self.queue.qsize()} jobs left")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, name: str, job, *args, attempt: int = 0) -> bool:
+        if self.queue is None:
+            # not running inside the app (scripts, tests): run it detached
+            asyncio.ensure_future(self._run_job(name, job, args, attempt))
+            return True
+        try:
+            self.queue.put_nowait((name, job, args, attempt))
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            print(f"[WARN] Enrichment queue full, dropping {name}")
+            return False
+        if attempt == 0:
+            self.stats["submitted"] += 1
+        return True
+
+    def _schedule_retry(self, name: str, job, args, attempt: int):
+        delay = self.retry_delay * (2 ** (attempt - 1))
+        loop = asyncio.get_running_loop()
+
+        def resubmit():
+            self.retry_handles.discard(handle)
+            self.submit(name, job, *args, attempt=attempt)
+
+        handle = loop.call_later(delay, resubmit)
+        self.retry_handles.add(handle)
+
+    async def _run_job(self, name: str, job, args, attempt: int):
+        start = time.perf_counter()
+        try:
+            await job(*args, final_attempt=attempt >= self.max_retries)
+        except Exception as e:
+            if attempt < self.max_retries:
+                self.stats["retried"] += 1
+                print(f"[WARN] Enrichment {name} failed (attempt {attempt + 1}/{self.max_retries + 1}): {e}")
+                self._schedule_retry(name, job, args, attempt + 1)
+            else:
+                self.stats["failed"] += 1
+                print(f"[ERROR] Enrichment {name} gave up: {e}")
+            return
+        self.stats["completed"] += 1
+        self.stats["last_duration"] = time.perf_counter() - start
+
+    async def _worker(self, index: int):
+        while True:
+            name, job, args, attempt = await self.queue.get()
+            self.stats["busy"] += 1
+            try:
+                await self._run_job(name, job, args, attempt)
+            finally:
+                self.stats["busy"] -= 1
+                self.queue.task_done()
+
+    def report(self) -> dict:
+        return {
+            "workers": len(self.tasks),
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "pending_retries": len(self.retry_handles),
+            **self.stats,
+        }
+
+enrichment_pool = EnrichmentPool()
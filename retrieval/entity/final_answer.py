@@ -14,4 +14,7 @@ class FinalResponse(BaseModel):
     is_answered: bool = False
     is_ask_helpdesk: bool = False
     is_faq: bool = False
-    is_feedback: bool = True
\ No newline at end of file
+    is_feedback: bool = True
+    is_cached: bool = False
+    llm_call_count: int = 0
+    llm_token_count: int = 0
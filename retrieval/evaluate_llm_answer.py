@@ -67,6 +67,7 @@ async def evaluate_llm_answer(user_query: str, history_context: str, llm_answer:
     """
 
     response = await ollama_chat_async(
+        stage="evaluate_llm_answer",
         model=model_name,
         messages=[
             {"role": "system", "content": prompt},
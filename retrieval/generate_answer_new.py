@@ -2,9 +2,9 @@ import os
 import re
 import time
 from dotenv import load_dotenv
-from util.async_ollama import ollama_chat_async
+from util.async_ollama import ollama_chat_async, ollama_chat_stream_async
 from util.sanitize_input import sanitize_input
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
 
 load_dotenv()
 
@@ -31,17 +31,14 @@ def get_fail_message(status: bool, helpdesk_active_status: bool) -> str:
     else:
         return "Mohon maaf, apakah Bapak/Ibu bisa tanyakan dengan lebih detail dan jelas?"
 
-async def generate_answer_new(user_query: str, history_context: str, platform: str, status: bool, helpdesk_active_status: bool, context_docs: list[str]):
-    async with ollama_semaphore:
-        print("Entering generate_answer_new method")
+def build_answer_prompt(user_query: str, history_context: str, status: bool, helpdesk_active_status: bool, context_docs: list[str]) -> str:
+    context = "\n\n".join(context_docs)
 
-        context = "\n\n".join(context_docs)
+    fail_message = get_fail_message(status, helpdesk_active_status)
 
-        fail_message = get_fail_message(status, helpdesk_active_status)
+    safe_query = sanitize_input(user_query)
 
-        safe_query = sanitize_input(user_query)
-
-        prompt = f"""
+    prompt = f"""
         <introduction>
         You are ""Asisten Virtual Badan Koordinasi Penanaman Modal", a formal, intelligent, and reliable assistant that always answers in Bahasa Indonesia.
                 
@@ -106,7 +103,7 @@ async def generate_answer_new(user_query: str, history_context: str, platform: s
         </output>
         """
 
-        user = f"""
+    user = f"""
         {prompt}
 
         <context>
@@ -125,9 +122,17 @@ async def generate_answer_new(user_query: str, history_context: str, platform: s
         Anda harus jawab dalam Bahasa Indonesia.
         </user_query>
         """
+    return user
+
+async def generate_answer_new(user_query: str, history_context: str, platform: str, status: bool, helpdesk_active_status: bool, context_docs: list[str]):
+    async with inference_scheduler.slot("generation", model_name):
+        print("Entering generate_answer_new method")
+
+        user = build_answer_prompt(user_query, history_context, status, helpdesk_active_status, context_docs)
 
         start = time.perf_counter()
         response = await ollama_chat_async(
+            stage="generate_answer",
             model=model_name,
             messages=[
                 # {"role": "system", "content": prompt},
@@ -145,3 +150,53 @@ async def generate_answer_new(user_query: str, history_context: str, platform: s
 
         print("Exiting generate_answer_new method")
         return return_response, duration
+
+class IncrementalCleanser:
+    def __init__(self):
+        self.buffer = ""
+        self.in_code_block = False
+
+    def _cleanse_line(self, line: str) -> str:
+        if line.strip().startswith("```"):
+            self.in_code_block = not self.in_code_block
+            return ""
+        if self.in_code_block:
+            return ""
+        line = re.sub(r"`([^`]*)`", r"\1", line)
+        line = re.sub(r"(\*\*|__)(.*?)\1", r"\2", line)
+        line = re.sub(r"([*_])(.*?)\1", r"\2", line)
+        line = re.sub(r"~~(.*?)~~", r"\1", line)
+        line = re.sub(r"^\s{0,3}#{1,6}\s+", "", line)
+        line = re.sub(r"^\s{0,3}>\s?", "", line)
+        return line + "\n"
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        if "\n" not in self.buffer:
+            return ""
+        *lines, self.buffer = self.buffer.split("\n")
+        return "".join(self._cleanse_line(line) for line in lines)
+
+    def flush(self) -> str:
+        rest, self.buffer = self.buffer, ""
+        return self._cleanse_line(rest).rstrip("\n") if rest else ""
+
+async def stream_answer_new(user_query: str, history_context: str, status: bool, helpdesk_active_status: bool, context_docs: list[str]):
+    async with inference_scheduler.slot("generation", model_name):
+        print("Entering stream_answer_new method")
+
+        user = build_answer_prompt(user_query, history_context, status, helpdesk_active_status, context_docs)
+
+        async for chunk in ollama_chat_stream_async(
+            stage="generate_answer",
+            model=model_name,
+            messages=[
+                {"role": "user", "content": user}
+            ],
+            options={"temperature": float(model_temperature), "repeat_penalty": 1.0, "top_k": 64, "top_p": 0.9, "num_ctx": 8000},
+        ):
+            content = chunk["message"]["content"]
+            if content:
+                yield content
+
+        print("Exiting stream_answer_new method")
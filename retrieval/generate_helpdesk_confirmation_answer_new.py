@@ -3,7 +3,7 @@ import re
 from dotenv import load_dotenv
 from util.async_ollama import ollama_chat_async
 from util.sanitize_input import sanitize_input
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
 
 load_dotenv()
 
@@ -36,7 +36,7 @@ Maaf, bapak/ibu dimohon untuk konfirmasi ya/tidak untuk pengalihan ke helpdesk a
 """
 
 async def generate_helpdesk_confirmation_answer_new(user_query: str, history_context: str) -> str:
-    async with ollama_semaphore:
+    async with inference_scheduler.slot("generation", model_name):
         print("Entering generate_helpdesk_confirmation_answer method")
 
         safe_input = sanitize_input(user_query)
@@ -54,6 +54,7 @@ async def generate_helpdesk_confirmation_answer_new(user_query: str, history_con
         """
 
         response = await ollama_chat_async(
+            stage="helpdesk_confirmation",
             model=model_name,
             messages=[
                 # {"role": "system", "content": prompt},
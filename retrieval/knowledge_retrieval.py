@@ -1,19 +1,24 @@
 import os
-import requests
 from dotenv import load_dotenv
 import asyncio
 import time
 from typing import List, Iterable
 import re
+from collections import OrderedDict
 from langchain_ollama import OllamaEmbeddings
-from langchain_qdrant import QdrantVectorStore, RetrievalMode
+from langchain_core.documents import Document
+from langchain_qdrant import RetrievalMode
+from qdrant_client import models
 from qdrant_client.models import SparseVector
-from util.qdrant_connection import vectordb_client
+from util.vectorstore_registry import vectorstore_registry
+from util.qdrant_connection import async_vectordb_client
+from util.bm25_client import bm25_client
 
 load_dotenv()
 
 TOP_K = int(os.getenv("TOP_K"))
-BM25_URL = os.getenv("BM25_URL")
+ASYNC_RETRIEVAL = os.getenv("ASYNC_RETRIEVAL", "true").lower() == "true"
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "512"))
 
 embedding_model = OllamaEmbeddings(
     model=os.getenv("EMBED_MODEL"),
@@ -40,68 +45,153 @@ def build_kbli_filter(kbli_code: str):
         ]
     }
 
-class BM25SparseEmbeddings:
-    def __init__(self, bm25_url: str):
-        self.bm25_url = bm25_url
-
-    def _convert_to_sparse_vector(self, vector_data) -> SparseVector:
-        if vector_data is None:
-            return SparseVector(indices=[], values=[])
-        
-        if isinstance(vector_data, dict):
-            indices = vector_data.get("indices", [])
-            values = vector_data.get("values", [])
-        elif isinstance(vector_data, list) and vector_data and isinstance(vector_data[0], (list, tuple)):
-            indices = [int(idx) for idx, _ in vector_data]
-            values = [float(val) for _, val in vector_data]
+sparse_embeddings = bm25_client
+
+def _points_to_documents(points, collection_name: str):
+    results = []
+    for point in points:
+        payload = point.payload or {}
+        metadata = dict(payload.get("metadata") or {})
+        metadata["_id"] = point.id
+        metadata["_collection_name"] = collection_name
+        doc = Document(page_content=payload.get("page_content") or "", metadata=metadata)
+        results.append((doc, point.score))
+    return results
+
+class QueryVectors:
+    def __init__(self, text: str, dense: list[float], sparse: SparseVector, latency: dict):
+        self.text = text
+        self.dense = dense
+        self.sparse = sparse
+        self.latency = latency
+
+class QueryEmbeddingCache:
+    def __init__(self, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0}
+
+    async def _embed(self, text: str) -> QueryVectors:
+        latency = {}
+
+        async def timed(name, coro):
+            start = time.perf_counter()
+            try:
+                return await coro
+            finally:
+                latency[name] = time.perf_counter() - start
+
+        dense, sparse = await asyncio.gather(
+            timed("embed_dense", embedding_model.aembed_query(text)),
+            timed("embed_sparse", sparse_embeddings.aembed_query(text)),
+        )
+        return QueryVectors(text, dense, sparse, latency)
+
+    async def get(self, text: str) -> QueryVectors:
+        task = self.entries.get(text)
+        if task is not None:
+            self.entries.move_to_end(text)
+            self.stats["hits"] += 1
         else:
-            print(f"Unexpected vector format: {type(vector_data)}")
-            return SparseVector(indices=[], values=[])
-        
-        return SparseVector(indices=indices, values=values)
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._embed(text))
+            self.entries[text] = task
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
 
-    def embed_documents(self, texts: list[str]) -> list:
         try:
-            response = requests.post(self.bm25_url, json={"texts": texts})
-            response.raise_for_status()
-            vectors = response.json().get("vectors", [])
-            return [self._convert_to_sparse_vector(v) for v in vectors]
-        except Exception as e:
-            print("BM25 batch retrieval error:", e)
-            return [SparseVector(indices=[], values=[]) for _ in texts]
-
-    def embed_query(self, text: str):
-        try:
-            response = requests.post(self.bm25_url, json={"texts": [text]})
-            response.raise_for_status()
-            vectors = response.json().get("vectors", [])
-            if vectors:
-                return self._convert_to_sparse_vector(vectors[0])
-            return SparseVector(indices=[], values=[])
-        except Exception as e:
-            print("BM25 retrieval error:", e)
-            return SparseVector(indices=[], values=[])
-        
-sparse_embeddings = BM25SparseEmbeddings(BM25_URL)
-
-async def retrieve_knowledge(user_query: str, collection_name: str, top_k: int = TOP_K):
+            vectors = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            if self.entries.get(text) is task:
+                del self.entries[text]
+            raise
+
+        if not vectors.sparse.indices and self.entries.get(text) is task:
+            # an empty sparse vector usually means BM25 failed; don't pin this query to dense-only results
+            del self.entries[text]
+        return vectors
+
+query_embedding_cache = QueryEmbeddingCache()
+
+async def embed_query_vectors(text: str) -> QueryVectors:
+    return await query_embedding_cache.get(text)
+
+async def _hybrid_search_async(query_vectors: QueryVectors, collection_name: str, top_k: int, filter_body: dict = None):
+    query_filter = models.Filter.model_validate(filter_body) if filter_body else None
+
+    start = time.perf_counter()
+    response = await async_vectordb_client.query_points(
+        collection_name=collection_name,
+        prefetch=[
+            models.Prefetch(query=query_vectors.dense, using="dense", limit=top_k, filter=query_filter),
+            models.Prefetch(query=query_vectors.sparse, using="sparse", limit=top_k, filter=query_filter),
+        ],
+        query=models.FusionQuery(fusion=models.Fusion.RRF),
+        limit=top_k,
+        with_payload=True,
+    )
+    latency = {"qdrant_query": time.perf_counter() - start}
+
+    return _points_to_documents(response.points, collection_name), latency
+
+async def _dense_search_async(query_vectors: QueryVectors, collection_name: str, top_k: int):
+    start = time.perf_counter()
+    response = await async_vectordb_client.query_points(
+        collection_name=collection_name,
+        query=query_vectors.dense,
+        using="dense",
+        limit=top_k,
+        with_payload=True,
+    )
+    latency = {"qdrant_query": time.perf_counter() - start}
+
+    return _points_to_documents(response.points, collection_name), latency
+
+async def _resolve_query_vectors(user_query: str, query_vectors: QueryVectors = None):
+    if query_vectors is not None and query_vectors.text == user_query:
+        return query_vectors, 0.0
+    start = time.perf_counter()
+    query_vectors = await embed_query_vectors(user_query)
+    return query_vectors, time.perf_counter() - start
+
+async def retrieve_knowledge(user_query: str, collection_name: str, top_k: int = TOP_K, query_vectors: QueryVectors = None):
     print("Entering retrieve_knowledge method")
     print(f"Collection: {collection_name}")
 
     is_kbli = is_kbli_query(user_query)
     kbli_code = extract_kbli(user_query)
 
+    if ASYNC_RETRIEVAL:
+        start = time.perf_counter()
+        filter_body = build_kbli_filter(kbli_code) if is_kbli and kbli_code else None
+        query_vectors, embed_duration = await _resolve_query_vectors(user_query, query_vectors)
+        results, latency = await _hybrid_search_async(query_vectors, collection_name, top_k, filter_body)
+        latency["embed"] = embed_duration
+        if collection_name == "peraturan_collection":
+            results = [
+                (doc, score) for doc, score in results
+                if "Cukup jelas." not in doc.page_content
+            ]
+        duration = time.perf_counter() - start
+        latency["total"] = duration
+        print(f"[INFO] Retrieval latency: {latency}")
+        print("Exiting retrieve_knowledge method")
+        return {
+            "docs": results,
+            "is_kbli": is_kbli,
+            "latency": latency,
+        }, duration
+
     loop = asyncio.get_event_loop()
 
     def sync_search():
-        vectorstore = QdrantVectorStore(
-            client=vectordb_client,
+        vectorstore = vectorstore_registry.get_store(
             collection_name=collection_name,
-            embedding=embedding_model,         
-            sparse_embedding=sparse_embeddings,  
             retrieval_mode=RetrievalMode.HYBRID,
-            vector_name="dense",
-            sparse_vector_name="sparse",
+            embedding=embedding_model,
+            sparse_embedding=sparse_embeddings,
         )
 
         if is_kbli and kbli_code:
@@ -136,7 +226,7 @@ async def retrieve_knowledge(user_query: str, collection_name: str, top_k: int =
         "is_kbli": is_kbli,
     }, duration
 
-async def retrieve_knowledge_faq(user_query: str, collection_name: str, top_k: int = TOP_K):
+async def retrieve_knowledge_faq(user_query: str, collection_name: str, top_k: int = TOP_K, query_vectors: QueryVectors = None):
     print("Entering retrieve_knowledge_faq method")
     print(f"Collection: {collection_name}")
 
@@ -144,15 +234,24 @@ async def retrieve_knowledge_faq(user_query: str, collection_name: str, top_k: i
         print("[INFO] KBLI query detected, skip FAQ retrieval")
         return [], 0
 
+    if ASYNC_RETRIEVAL:
+        start = time.perf_counter()
+        query_vectors, embed_duration = await _resolve_query_vectors(user_query, query_vectors)
+        results, latency = await _dense_search_async(query_vectors, "qna_collection", top_k)
+        latency["embed"] = embed_duration
+        duration = time.perf_counter() - start
+        latency["total"] = duration
+        print(f"[INFO] FAQ retrieval latency: {latency}")
+        print("Exiting retrieve_knowledge_faq method")
+        return results, duration
+
     loop = asyncio.get_event_loop()
 
     def sync_search():
-        vectorstore = QdrantVectorStore(
-            client=vectordb_client,
+        vectorstore = vectorstore_registry.get_store(
             collection_name="qna_collection",
-            embedding=embedding_model,         
             retrieval_mode=RetrievalMode.DENSE,
-            vector_name="dense",
+            embedding=embedding_model,
         )
 
         return vectorstore.similarity_search_with_score(
@@ -0,0 +1,105 @@
+import os
+import re
+import time
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+WEIGHT_HYBRID = float(os.getenv("LOCAL_RERANK_WEIGHT_HYBRID", "0.5"))
+WEIGHT_BM25 = float(os.getenv("LOCAL_RERANK_WEIGHT_BM25", "0.3"))
+WEIGHT_KBLI = float(os.getenv("LOCAL_RERANK_WEIGHT_KBLI", "0.1"))
+WEIGHT_PASAL = float(os.getenv("LOCAL_RERANK_WEIGHT_PASAL", "0.1"))
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "yang", "dan", "di", "ke", "dari", "untuk", "dengan", "apa", "apakah", "bagaimana", "cara",
+    "saya", "ini", "itu", "atau", "ada", "adalah", "pada", "dalam", "bisa", "tidak", "akan",
+    "juga", "oleh", "sebagai", "mohon", "tolong", "ya", "kah", "nya",
+}
+
+TOKEN_PATTERN = re.compile(r"\w+")
+KBLI_CODE_PATTERN = re.compile(r"\b\d{5}\b")
+PASAL_PATTERN = re.compile(r"\bpasal\s+(\d+[a-z]?)\b", re.IGNORECASE)
+
+def tokenize(text: str) -> list[str]:
+    return [t for t in TOKEN_PATTERN.findall((text or "").lower()) if len(t) > 1 and t not in STOPWORDS]
+
+def _min_max(values: np.ndarray) -> np.ndarray:
+    if values.size == 0:
+        return values
+    spread = values.max() - values.min()
+    if spread == 0:
+        return np.ones_like(values) if values.max() > 0 else np.zeros_like(values)
+    return (values - values.min()) / spread
+
+class LocalReranker:
+    name = "local"
+
+    def bm25_scores(self, query: str, docs: list[str]) -> np.ndarray:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not docs:
+            return np.zeros(len(docs), dtype=np.float32)
+
+        term_index = {term: i for i, term in enumerate(terms)}
+        tf = np.zeros((len(docs), len(terms)), dtype=np.float32)
+        doc_len = np.zeros(len(docs), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            tokens = tokenize(doc)
+            doc_len[row] = len(tokens)
+            for token in tokens:
+                col = term_index.get(token)
+                if col is not None:
+                    tf[row, col] += 1
+
+        df = (tf > 0).sum(axis=0)
+        idf = np.log((len(docs) - df + 0.5) / (df + 0.5) + 1.0)
+        avg_len = doc_len.mean() if doc_len.mean() > 0 else 1.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avg_len)
+        scores = (tf * (BM25_K1 + 1)) / (tf + norm[:, None])
+        return (scores * idf).sum(axis=1)
+
+    def match_features(self, query: str, docs: list[str]):
+        query_kbli = set(KBLI_CODE_PATTERN.findall(query or ""))
+        query_pasal = {p.lower() for p in PASAL_PATTERN.findall(query or "")}
+
+        kbli = np.zeros(len(docs), dtype=np.float32)
+        pasal = np.zeros(len(docs), dtype=np.float32)
+        for row, doc in enumerate(docs):
+            if query_kbli and query_kbli & set(KBLI_CODE_PATTERN.findall(doc)):
+                kbli[row] = 1.0
+            if query_pasal:
+                header = doc[:200]
+                if query_pasal & {p.lower() for p in PASAL_PATTERN.findall(header)}:
+                    pasal[row] = 1.0
+        return kbli, pasal
+
+    def score(self, query: str, docs: list[str], scores: list[float] = None) -> np.ndarray:
+        n = len(docs)
+        if scores is not None and len(scores) == n:
+            hybrid = _min_max(np.asarray(scores, dtype=np.float32))
+        else:
+            hybrid = 1.0 / (np.arange(n, dtype=np.float32) + 1.0)
+
+        bm25 = _min_max(self.bm25_scores(query, docs))
+        kbli, pasal = self.match_features(query, docs)
+        return WEIGHT_HYBRID * hybrid + WEIGHT_BM25 * bm25 + WEIGHT_KBLI * kbli + WEIGHT_PASAL * pasal
+
+    async def rerank(self, query, docs, fileids, filenames, top_k=3, scores=None):
+        start = time.perf_counter()
+        if not docs:
+            return [], [], [], 0
+
+        combined = self.score(query, docs, scores)
+        order = np.argsort(-combined, kind="stable")[:top_k]
+        duration = time.perf_counter() - start
+        return (
+            [docs[i] for i in order],
+            [fileids[i] for i in order],
+            [filenames[i] for i in order],
+            duration,
+        )
+
+local_reranker = LocalReranker()
@@ -1,13 +1,160 @@
 from util.db_connection import get_pool, pool_stats
+from util.write_behind import analytics_writer
+from util.config_cache import config_cache
+from .conversation_state import ConversationState, conversation_state_cache, extract_kbli_codes, HISTORY_LIMIT, FAIL_HISTORY_LIMIT
+import os
+import asyncio
 import datetime
 import pytz
 import json
 import uuid
 
+CHAT_TURN_WRITE_BEHIND = os.getenv("CHAT_TURN_WRITE_BEHIND", "false").lower() == "true"
+
+COLLECTION_CATEGORIES = {
+    "panduan_collection": "panduan",
+    "peraturan_collection": "peraturan",
+    "uraian_collection": "uraian",
+    "faq_collection": "faq",
+}
+
+# ChatTurnRecord.set_durations argument -> bkpm.run_times column and its SQL type
+DURATION_COLUMNS = {
+    "qdrant_duration_1": ("qdrant_faq_time", "float8"),
+    "qdrant_duration_2": ("qdrant_main_time", "float8"),
+    "rerank_duration": ("rerank_time", "float8"),
+    "llm_duration": ("llm_time", "float8"),
+    "rewrite_duration": ("duration_rewriter", "float8"),
+    "classify_col_duration": ("duration_classify_collection", "float8"),
+    "question_classify_duration": ("duration_question_classifier", "float8"),
+    "kbli_duration": ("duration_classify_kbli", "float8"),
+    "specific_duration": ("duration_classify_specific", "float8"),
+    "llm_call_count": ("llm_call_count", "int"),
+    "llm_token_count": ("llm_token_count", "int"),
+}
+
+UNSET = object()
+
+def kbli_codes_cte(session_param: str, codes_param: str) -> str:
+    # asked codes are recorded per conversation so the repeat check never rescans chat_history
+    return f""", kbli_codes AS (
+            INSERT INTO bkpm.conversation_kbli_codes (session_id, kbli_code)
+            SELECT {session_param}, code FROM unnest({codes_param}::text[]) AS code
+            ON CONFLICT (session_id, kbli_code) DO NOTHING
+        )
+        """
+
+# turn writes scheduled in write-behind mode, drained on shutdown
+pending_turn_writes = set()
+
+class ChatTurnRecord:
+    """Collects every write of one answered chat turn so they can be flushed in a single statement."""
+
+    def __init__(self, session_id: str, human_message: str, ai_message: str, rewritten: str = ""):
+        self.session_id = session_id
+        self.human_message = human_message
+        self.ai_message = ai_message
+        self.rewritten = rewritten
+        self.start_timestamp = UNSET
+        self.is_answered = UNSET
+        self.is_cannot_answer = UNSET
+        self.category = UNSET
+        self.question_category = UNSET
+        self.question_sub_category = UNSET
+        self.citations = UNSET
+        self.durations = None
+
+    def set_start_timestamp(self, start_timestamp: datetime):
+        self.start_timestamp = start_timestamp
+
+    def flag_answered(self, is_answered: bool):
+        self.is_answered = is_answered
+
+    def flag_cannot_answer(self):
+        self.is_cannot_answer = True
+
+    def set_category(self, col_name: str):
+        self.category = COLLECTION_CATEGORIES[col_name]
+        return self.category
+
+    def set_question_category(self, category: str, sub_category: str):
+        self.question_category = category
+        self.question_sub_category = sub_category
+        return category, sub_category
+
+    def set_citations(self, citations: list):
+        self.citations = json.dumps([{"id": cid, "name": cname} for cid, cname in citations])
+
+    def set_durations(self, **durations):
+        self.durations = {name: durations.get(name, 0) for name in DURATION_COLUMNS}
+
+    def build_query(self):
+        human_dict = {"data": {"type": "human", "content": self.human_message, "rewritten": self.rewritten}, "type": "human"}
+        ai_dict = {"data": {"id": str(uuid.uuid4()), "type": "ai", "content": self.ai_message}, "type": "ai"}
+        args = [self.session_id, json.dumps(human_dict), json.dumps(ai_dict)]
+        columns = ["session_id", "message"]
+        question_values = ["$1", "$2"]
+        answer_values = ["$1", "$3"]
+
+        def param(value):
+            if value is UNSET:
+                return "DEFAULT"
+            args.append(value)
+            return f"${len(args)}"
+
+        def add(column, question_value, answer_value=UNSET):
+            if question_value is UNSET and answer_value is UNSET:
+                return
+            columns.append(column)
+            question_values.append(param(question_value))
+            answer_values.append(param(answer_value))
+
+        add("start_timestamp", self.start_timestamp, self.start_timestamp)
+        add("is_answered", self.is_answered, self.is_answered)
+        add("is_cannot_answer", self.is_cannot_answer)
+        add("category", self.category)
+        add("question_category", self.question_category)
+        add("question_sub_category", self.question_sub_category)
+        add("citation", self.citations)
+
+        query = f"""
+        WITH inserted AS (
+            INSERT INTO bkpm.chat_history ({", ".join(columns)})
+            VALUES
+            ({", ".join(question_values)}),
+            ({", ".join(answer_values)})
+            RETURNING id
+        )
+        """
+
+        if self.durations is not None:
+            duration_columns = []
+            duration_values = []
+            for name, (column, sql_type) in DURATION_COLUMNS.items():
+                duration_columns.append(column)
+                duration_values.append(f"{param(self.durations[name])}::{sql_type}")
+            query += f""", durations AS (
+            INSERT INTO bkpm.run_times (dttm, question_id, answer_id, {", ".join(duration_columns)})
+            SELECT NOW(), MIN(id), MAX(id), {", ".join(duration_values)} FROM inserted
+        )
+        """
+
+        kbli_codes = list(dict.fromkeys(extract_kbli_codes(self.rewritten)))
+        if kbli_codes:
+            query += kbli_codes_cte("$1", param(kbli_codes))
+
+        query += "SELECT id FROM inserted ORDER BY id;"
+        return query, args
+
 class ChatflowRepository:
     def __init__(self):
-        self.history_limit=6
+        self.history_limit=HISTORY_LIMIT
         self.timezone="Asia/Jakarta"
+        self.state_cache = conversation_state_cache
+        self.config_cache = config_cache
+        self.config_cache.register("switch_helpdesk", self.load_helpdesk_activation)
+        self.config_cache.register("greetings", self.load_greetings)
+        self.config_cache.register("operation_time", self.load_operation_time)
         print("ChatflowRepository Initiated")
 
     async def create_new_conversation(self, session_id:str, platform:str, user_id:str):
@@ -26,60 +173,28 @@ class ChatflowRepository:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             await conn.execute(query, session_id, now, platform, user_id)
+        self.state_cache.put(ConversationState(session_id, exists=True))
         print("conversation created successfully")
 
-    async def get_greetings(self, greetings_id: int):
-        print("Entering get_greetings method")
+    async def load_greetings(self):
+        print("Entering load_greetings method")
         query = """
-        SELECT greetings_text FROM bkpm.greetings WHERE id=$1
+        SELECT id, greetings_text FROM bkpm.greetings
         """
         pool = await get_pool()
         async with pool.acquire() as conn:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            greetings = await conn.fetchval(query, greetings_id)
-            print("Exiting get_greetings method")
-            return greetings
-        
-    async def get_context(self, session_id: str):
-        print("Getting conversation context...")
-
-        if session_id == "":
-            print("No conversation context retrieved.")
-            return "Conversation History:"
-
-        pool = await get_pool()
-
-        query = """
-        SELECT message ->> 'type' AS type, message -> 'data' ->> 'content' AS content
-        FROM bkpm.chat_history WHERE session_id = $1
-        ORDER BY id DESC LIMIT $2
-        """
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            rows = await conn.fetch(query, session_id, self.history_limit)
-        rows = list(rows)[::-1]
-
-        AUTO_ERROR_MESSAGE = (
-            "Mohon maaf, saat ini terdapat peningkatan jumlah pesan yang masuk. Silakan kirim ulang pesan Anda beberapa saat lagi. Terimakasih."
-        )
+            rows = await conn.fetch(query)
+        print("Exiting load_greetings method")
+        return {row["id"]: row["greetings_text"] for row in rows}
 
-        context_parts = ["Conversation History:"]
-        for i, row in enumerate(rows):
-            if row["type"] == "ai" and row["content"] and AUTO_ERROR_MESSAGE in row["content"]:
-                continue
-
-            block = f"""
-            {i + 1}. type: {row['type']}
-            content: {row['content']}
-            """
-            context_parts.append(block)
-        history_string = "\n".join(context_parts)
-        # print(history_string.strip())
-        print("Conversation context retrieved!")
-        return history_string.strip()
-    
+    async def get_greetings(self, greetings_id: int):
+        print("Entering get_greetings method")
+        greetings = (await self.config_cache.get("greetings")).get(greetings_id)
+        print("Exiting get_greetings method")
+        return greetings
+        
     async def change_is_helpdesk(self, session_id: str):
         print("Entering change_is_helpdesk method")
 
@@ -94,6 +209,9 @@ class ChatflowRepository:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             await conn.execute(query, session_id)
+        state = self.state_cache.peek(session_id)
+        if state is not None:
+            state.is_helpdesk = True
         print("Exiting change_is_helpdesk method")
     
     async def increment_helpdesk_count(self, session_id: str):
@@ -159,9 +277,10 @@ class ChatflowRepository:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             await conn.execute(query, session_id, question)
+        self.state_cache.invalidate(session_id)
         print("Exiting flag_message_cannot_answer method")
 
-    async def flag_message_cannot_answer_by_id(self, question_id: int):
+    async def flag_message_cannot_answer_by_id(self, session_id: str, question_id: int):
         print("Entering flag_message_cannot_answer_by_id method")
         query = """
         UPDATE bkpm.chat_history
@@ -173,6 +292,7 @@ class ChatflowRepository:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             await conn.execute(query, question_id)
+        self.state_cache.flag_cannot_answer(session_id, question_id)
         print("Exiting flag_message_cannot_answer_by_id method")
 
     async def ingest_category(self, question_id: int, col_name: str):
@@ -180,58 +300,18 @@ class ChatflowRepository:
         print(f"question_id: {question_id}")
         print(f"col_name: {col_name}")
 
-        if col_name == "panduan_collection":
-            category = "panduan"
-        elif col_name == "peraturan_collection":
-            category = "peraturan"
-        elif col_name == "uraian_collection":
-            category = "uraian"
-        elif col_name == "faq_collection":
-            category = "faq"
+        category = COLLECTION_CATEGORIES[col_name]
         query="""
         UPDATE bkpm.chat_history
         SET category = $1
         WHERE id = $2;
         """
 
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            await conn.execute(query, category, question_id)
+        await analytics_writer.execute(query, category, question_id)
 
         print("Exiting ingest_category method")
         return category
     
-    async def check_fail_history(self, session_id:str):
-        print("Checking the last chat history...")
-
-        query = """
-        SELECT is_cannot_answer
-        FROM bkpm.chat_history
-        WHERE session_id = $1
-          AND message -> 'data' ->> 'type' = 'human'
-        ORDER BY created_at DESC
-        LIMIT 4;
-        """
-
-        pool = await get_pool()
-
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            rows = await conn.fetch(query, session_id)
-
-        boolean_values = [row["is_cannot_answer"] for row in rows]
-        is_all_true = (len(boolean_values) == 4) and all(val is True for val in boolean_values)
-
-        if is_all_true:
-            print("4 consecutive messages are tagged as 'Cannot Answer', redirecting...")
-        else:
-            print("Less than 4 are tagged 'Cannot Answer', continuing conversation...")
-
-        return is_all_true
-    
     async def give_conversation_title(self, session_id:str, rewritten:str):
         print("Ingesting title for this conversation")
         query = """
@@ -241,11 +321,7 @@ class ChatflowRepository:
             AND context IS NULL;
         """
 
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            await conn.execute(query, rewritten, session_id)
+        await analytics_writer.execute(query, rewritten, session_id)
         print("Exiting give_conversation_title method")
 
     async def ingest_question_category(self, question_id: int, category: str, sub_category: str):
@@ -255,15 +331,20 @@ class ChatflowRepository:
         SET question_category = $1, question_sub_category = $2
         WHERE id = $3;
         """
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            await conn.execute(query, category, sub_category, question_id)
+        await analytics_writer.execute(query, category, sub_category, question_id)
 
         print(f"Message categorized as {category} and {sub_category} successfuly")
         return category, sub_category
     
+    async def ingest_question_classifier_duration(self, question_id: int, duration: float):
+        print("Ingesting question classifier duration")
+        query = """
+        UPDATE bkpm.run_times
+        SET duration_question_classifier = $1
+        WHERE question_id = $2;
+        """
+        await analytics_writer.execute(query, duration, question_id)
+
     async def ingest_citations(self, citations: list, question_id: int):
         print("Entering ingest_citations method...")
 
@@ -297,25 +378,11 @@ class ChatflowRepository:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             await conn.execute(query, session_id)
+        state = self.state_cache.peek(session_id)
+        if state is not None:
+            state.is_ask_helpdesk = not state.is_ask_helpdesk
         print("Exiting change_is_helpdesk_status method...")
 
-    async def check_is_ask_helpdesk(self, session_id: str):
-        print("Entering check_is_ask_helpdesk method")
-
-        query="""
-        SELECT is_ask_helpdesk
-        FROM bkpm.conversations
-        WHERE id = $1;
-        """
-
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            is_ask_helpdesk = await conn.fetchval(query, session_id)
-        print("Exiting check_is_ask_helpdesk method")
-        return is_ask_helpdesk
-    
     async def ingest_created_at_chat_history(self, session_id: str, question: str):
         print("Entering ingest_created_at method")
 
@@ -348,8 +415,8 @@ class ChatflowRepository:
 
         print("Exiting ingest_created_at method")
 
-    async def get_helpdesk_operation_status(self):
-        print("Entering get_helpdesk_operation_status method")
+    async def load_operation_time(self):
+        print("Entering load_operation_time method")
 
         query = """
         SELECT description, time_info FROM operation_time
@@ -362,11 +429,17 @@ class ChatflowRepository:
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             rows = await conn.fetch(query)
 
-        op = {row["description"]: row["time_info"] for row in rows}
+        print("Exiting load_operation_time method")
+        return {row["description"]: row["time_info"] for row in rows}
+
+    async def get_helpdesk_operation_status(self):
+        print("Entering get_helpdesk_operation_status method")
+
+        op = await self.config_cache.get("operation_time")
         start = op["start_time"]
         stop = op["stop_time"]
         jakarta = pytz.timezone(self.timezone)
-        now_time = datetime.now(jakarta).time()
+        now_time = datetime.datetime.now(jakarta).time()
 
         print("Exiting get_helpdesk_operation_status method")
         return start <= now_time <= stop
@@ -432,26 +505,8 @@ class ChatflowRepository:
         print("Exiting get_chat_history_id method")
         return row["id"], row["answer_id"]
     
-    async def check_is_helpdesk(self, session_id: str):
-        print("Entering check_is_helpdesk method")
-
-        query="""
-        SELECT is_helpdesk
-        FROM bkpm.conversations
-        WHERE id = $1;
-        """
-
-        pool = await get_pool()
-        async with pool.acquire() as conn:
-            pool_status = pool_stats(pool)
-            print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            is_ask_helpdesk = await conn.fetchval(query, session_id)
-        
-        print("Exiting check_is_helpdesk method")
-        return is_ask_helpdesk
-
-    async def check_helpdesk_activation(self):
-        print("Entering check_helpdesk_activation method")
+    async def load_helpdesk_activation(self):
+        print("Entering load_helpdesk_activation method")
 
         query="""
         SELECT status
@@ -467,6 +522,12 @@ class ChatflowRepository:
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
             helpdesk_active_status = await conn.fetchval(query)
 
+        print("Exiting load_helpdesk_activation method")
+        return helpdesk_active_status
+
+    async def check_helpdesk_activation(self):
+        print("Entering check_helpdesk_activation method")
+        helpdesk_active_status = await self.config_cache.get("switch_helpdesk")
         print("Exiting check_helpdesk_activation method")
         return helpdesk_active_status
 
@@ -479,62 +540,159 @@ class ChatflowRepository:
         ai_dict = {"data": {"id": ai_message_id, "type": "ai", "content": ai_message}, "type": "ai"}
 
         query="""
-        INSERT INTO bkpm.chat_history (session_id, message)
-        VALUES
-        ($1, $2),
-        ($1, $3)
-        RETURNING id;
+        WITH inserted AS (
+            INSERT INTO bkpm.chat_history (session_id, message)
+            VALUES
+            ($1, $2),
+            ($1, $3)
+            RETURNING id
+        )
         """
+        args = [session_id, json.dumps(human_dict), json.dumps(ai_dict)]
+
+        kbli_codes = list(dict.fromkeys(extract_kbli_codes(rewritten)))
+        if kbli_codes:
+            query += kbli_codes_cte("$1", "$4")
+            args.append(kbli_codes)
+        query += "SELECT id FROM inserted ORDER BY id;"
 
         pool = await get_pool()
         async with pool.acquire() as conn:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            rows = await conn.fetch(query, session_id, json.dumps(human_dict), json.dumps(ai_dict))
+            rows = await conn.fetch(query, *args)
 
         if len(rows) == 2:
             question_id = rows[0]["id"]
             answer_id = rows[1]["id"]
             
             print(f"Successfully inserted rows. Question ID: {question_id}, Answer ID: {answer_id}")
+            self.record_turn_in_state(session_id, question_id, human_message, ai_message, rewritten)
             
             return question_id, answer_id
         else:
             print("Warning: Failed to retrieve both IDs after insertion.")
             return 0, 0
         
-    async def get_rewritten_messages(self, session_id: str) -> list[str]:
-        print("Entering get_rewritten_messages method")
+    async def save_turn(self, turn: ChatTurnRecord):
+        print("Entering save_turn method")
 
-        query = """
-        SELECT message -> 'data' ->> 'rewritten' AS content
-        FROM bkpm.chat_history
-        WHERE session_id = $1
-        AND message ->> 'type' = 'human'
-        """
+        query, args = turn.build_query()
 
         pool = await get_pool()
         async with pool.acquire() as conn:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            rows = await conn.fetch(query, session_id)
+            async with conn.transaction():
+                rows = await conn.fetch(query, *args)
 
-        print("Exiting get_rewritten_messages method")
-        return [row["content"] for row in rows]
-    
-    async def insert_durations(self, question_id: int, answer_id: int, qdrant_duration_1: float, qdrant_duration_2: float, rerank_duration: float, llm_duration: float, rewrite_duration: float = 0, classify_col_duration: float = 0, question_classify_duration: float = 0, kbli_duration: float = 0, specific_duration: float = 0):
-        print("Entering insert_durations method")
+        if len(rows) == 2:
+            question_id = rows[0]["id"]
+            answer_id = rows[1]["id"]
+            print(f"Chat turn saved. Question ID: {question_id}, Answer ID: {answer_id}")
+            return question_id, answer_id
+        else:
+            print("Warning: Failed to retrieve both IDs after saving chat turn.")
+            return 0, 0
+
+    async def _save_turn_background(self, turn: ChatTurnRecord, fail_row: dict = None, on_saved=None):
+        try:
+            question_id, answer_id = await self.save_turn(turn)
+        except Exception as e:
+            print(f"[ERROR] Write-behind save_turn failed for session {turn.session_id}: {e}")
+            return
+        if fail_row is not None:
+            # the cached state recorded this turn before its id existed
+            fail_row["id"] = question_id
+        if on_saved is not None:
+            on_saved(question_id, answer_id)
+
+    async def persist_turn(self, turn: ChatTurnRecord, write_behind: bool = CHAT_TURN_WRITE_BEHIND, on_saved=None):
+        """on_saved(question_id, answer_id) runs once the turn's ids are known, which is later in write-behind mode."""
+        is_cannot_answer = turn.is_cannot_answer if turn.is_cannot_answer is not UNSET else None
+        if not write_behind:
+            question_id, answer_id = await self.save_turn(turn)
+            self.record_turn_in_state(turn.session_id, question_id, turn.human_message, turn.ai_message, turn.rewritten, is_cannot_answer)
+            if on_saved is not None:
+                on_saved(question_id, answer_id)
+            return question_id, answer_id
+
+        # ids are only known once the insert runs, so write-behind turns report 0/0
+        fail_row = self.record_turn_in_state(turn.session_id, 0, turn.human_message, turn.ai_message, turn.rewritten, is_cannot_answer)
+        task = asyncio.create_task(self._save_turn_background(turn, fail_row, on_saved))
+        pending_turn_writes.add(task)
+        task.add_done_callback(pending_turn_writes.discard)
+        return 0, 0
+
+    def record_turn_in_state(self, session_id: str, question_id: int, human_message: str, ai_message: str, rewritten: str = "", is_cannot_answer=None):
+        state = self.state_cache.peek(session_id)
+        if state is not None:
+            return state.append_turn(question_id, human_message, ai_message, rewritten, is_cannot_answer)
+        return None
+
+    async def load_conversation_state(self, session_id: str) -> ConversationState:
+        print("Entering load_conversation_state method")
+        if session_id == "":
+            return ConversationState(session_id)
+
+        state = self.state_cache.get(session_id)
+        if state is not None:
+            print("Exiting load_conversation_state method (cached)")
+            return state
 
         query = """
-        INSERT INTO bkpm.run_times (dttm, question_id, answer_id, qdrant_faq_time, qdrant_main_time, rerank_time, llm_time, duration_rewriter, duration_classify_collection, duration_question_classifier, duration_classify_kbli, duration_classify_specific)
-        VALUES
-        (NOW(), $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11);
+        SELECT
+            c.id IS NOT NULL AS conversation_exists,
+            COALESCE(c.is_helpdesk, FALSE) AS is_helpdesk,
+            COALESCE(c.is_ask_helpdesk, FALSE) AS is_ask_helpdesk,
+            (
+                SELECT COALESCE(json_agg(json_build_object('type', h.type, 'content', h.content) ORDER BY h.id), '[]'::json)
+                FROM (
+                    SELECT id, message ->> 'type' AS type, message -> 'data' ->> 'content' AS content
+                    FROM bkpm.chat_history WHERE session_id = $2
+                    ORDER BY id DESC LIMIT $3
+                ) h
+            ) AS history,
+            (
+                SELECT COALESCE(json_agg(json_build_object('id', f.id, 'is_cannot_answer', f.is_cannot_answer) ORDER BY f.created_at DESC), '[]'::json)
+                FROM (
+                    SELECT id, is_cannot_answer, created_at
+                    FROM bkpm.chat_history
+                    WHERE session_id = $2
+                      AND message -> 'data' ->> 'type' = 'human'
+                    ORDER BY created_at DESC
+                    LIMIT $4
+                ) f
+            ) AS fail_history,
+            (
+                SELECT COALESCE(array_agg(kbli_code), '{}')
+                FROM bkpm.conversation_kbli_codes
+                WHERE session_id = $2
+            ) AS asked_kbli_codes
+        FROM (SELECT 1) AS one
+        LEFT JOIN bkpm.conversations c ON c.id = $1;
         """
 
         pool = await get_pool()
         async with pool.acquire() as conn:
             pool_status = pool_stats(pool)
             print(f"Using DB: Max Size: 50, Opened Connection: {pool_status['size']}, Idle: {pool_status['idle']}, Used: {pool_status['in_use']}")
-            await conn.execute(query, question_id, answer_id, qdrant_duration_1, qdrant_duration_2, rerank_duration, llm_duration, rewrite_duration, classify_col_duration, question_classify_duration, kbli_duration, specific_duration)
-
-        print("Exiting insert_durations method")
+            row = await conn.fetchrow(query, session_id, session_id, self.history_limit, FAIL_HISTORY_LIMIT)
+
+        state = ConversationState(
+            session_id,
+            exists=row["conversation_exists"],
+            is_helpdesk=row["is_helpdesk"],
+            is_ask_helpdesk=row["is_ask_helpdesk"],
+            history=json.loads(row["history"]),
+            fail_history=json.loads(row["fail_history"]),
+            asked_kbli_codes=set(row["asked_kbli_codes"]),
+        )
+        self.state_cache.put(state)
+        print("Exiting load_conversation_state method")
+        return state.copy()
+
+async def drain_pending_turn_writes():
+    if pending_turn_writes:
+        print(f"Waiting for {len(pending_turn_writes)} pending chat turn writes")
+        await asyncio.gather(*pending_turn_writes, return_exceptions=True)
@@ -1,34 +1,174 @@
 from dotenv import load_dotenv
+from bisect import bisect_left
 import httpx
 import time
+import asyncio
 import os
+from util.request_budget import remaining_budget
+from .local_rerank import local_reranker
 
 load_dotenv()
 API_URL = os.getenv("RERANK_URL")
+RERANK_TIMEOUT = float(os.getenv("RERANK_TIMEOUT", "30"))
+RERANK_MIN_TIMEOUT = float(os.getenv("RERANK_MIN_TIMEOUT", "1"))
+RERANK_HTTP2 = os.getenv("RERANK_HTTP2", "false").lower() == "true"
+RERANK_FAILURE_THRESHOLD = int(os.getenv("RERANK_FAILURE_THRESHOLD", "3"))
+RERANK_COOLDOWN = float(os.getenv("RERANK_COOLDOWN", "30"))
+RERANK_BACKEND = os.getenv("RERANK_BACKEND", "remote")
+RERANK_FALLBACK = os.getenv("RERANK_FALLBACK", "local")
+RERANK_COMPARE = os.getenv("RERANK_COMPARE", "false").lower() == "true"
 
-async def rerank_documents(query, docs, fileids, filenames, top_k=3):
-    print("Entering rerank_documents_with_flag method")
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60]
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = RERANK_FAILURE_THRESHOLD, cooldown: float = RERANK_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.half_open_trial = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """Returns None when the call must be skipped, "trial" when the caller owns the half-open trial and must end_trial()."""
+        state = self.state
+        if state == "closed":
+            return "closed"
+        if state == "half_open" and not self.half_open_trial:
+            self.half_open_trial = True
+            return "trial"
+        return None
+
+    def end_trial(self):
+        self.half_open_trial = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            print(f"[WARN] Reranker circuit opened after {self.failures} failures")
+            self.opened_at = time.monotonic()
+
+class RerankClient:
+    name = "remote"
+
+    def __init__(self, url: str = API_URL, http2: bool = RERANK_HTTP2):
+        self.url = url
+        self.http2 = http2
+        self.client = None
+        self.breaker = CircuitBreaker()
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.stats = {"calls": 0, "fallbacks": 0, "short_circuited": 0}
+
+    async def start(self):
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=RERANK_TIMEOUT,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=60.0)
+            )
+            print(f"Rerank client started (http2={self.http2})")
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            print("Rerank client closed")
+
+    def _observe(self, duration: float):
+        self.latency_histogram[bisect_left(LATENCY_BUCKETS, duration)] += 1
+
+    def _call_timeout(self):
+        remaining = remaining_budget(default=RERANK_TIMEOUT)
+        return min(RERANK_TIMEOUT, remaining)
 
-    payload = {
-        "query": query,
-        "docs": docs,
-        "fileids": fileids,
-        "filenames": filenames
-    }
-
-    try:
-        start = time.perf_counter()
-        async with httpx.AsyncClient(timeout=600) as client:
-            response = await client.post(API_URL, json=payload)
-        end = time.perf_counter()
-        duration = end - start
-        response.raise_for_status()
-
-        response_list = response.json()
-        reranked_docs, reranked_fileids, reranked_filenames = response_list
-
-        print("Exiting rerank_documents_with_flag method")
-        return reranked_docs, reranked_fileids, reranked_filenames, duration
-    except Exception as e:
-        print(f"Reranking error: {str(e)}, using original scores")
+    def metrics(self) -> dict:
+        buckets = [f"<={b}s" for b in LATENCY_BUCKETS] + [f">{LATENCY_BUCKETS[-1]}s"]
+        return {
+            **self.stats,
+            "circuit": self.breaker.state,
+            "latency_histogram": dict(zip(buckets, self.latency_histogram)),
+        }
+
+    async def _fallback(self, query, docs, fileids, filenames, top_k, scores):
+        self.stats["fallbacks"] += 1
+        if RERANK_FALLBACK == "local":
+            return await local_reranker.rerank(query, docs, fileids, filenames, top_k, scores)
         return docs[:top_k], fileids[:top_k], filenames[:top_k], 0
+
+    async def rerank(self, query, docs, fileids, filenames, top_k=3, scores=None):
+        self.stats["calls"] += 1
+
+        timeout = self._call_timeout()
+        if timeout < RERANK_MIN_TIMEOUT:
+            print(f"[WARN] Request budget nearly spent ({timeout:.2f}s left), skipping rerank")
+            return await self._fallback(query, docs, fileids, filenames, top_k, scores)
+
+        admission = self.breaker.allow()
+        if admission is None:
+            print("[WARN] Reranker circuit open, using fallback order")
+            self.stats["short_circuited"] += 1
+            return await self._fallback(query, docs, fileids, filenames, top_k, scores)
+
+        try:
+            await self.start()
+            payload = {
+                "query": query,
+                "docs": docs,
+                "fileids": fileids,
+                "filenames": filenames
+            }
+
+            start = time.perf_counter()
+            try:
+                response = await self.client.post(self.url, json=payload, timeout=timeout)
+                response.raise_for_status()
+                reranked_docs, reranked_fileids, reranked_filenames = response.json()
+            except Exception as e:
+                duration = time.perf_counter() - start
+                self._observe(duration)
+                # running out of this request's own budget says nothing about the reranker's health
+                budget_timeout = isinstance(e, (httpx.TimeoutException, asyncio.TimeoutError)) and timeout < RERANK_TIMEOUT
+                if not budget_timeout:
+                    self.breaker.record_failure()
+                print(f"Reranking error: {str(e)}, using fallback order")
+                return await self._fallback(query, docs, fileids, filenames, top_k, scores)
+
+            duration = time.perf_counter() - start
+            self._observe(duration)
+            self.breaker.record_success()
+            return reranked_docs, reranked_fileids, reranked_filenames, duration
+        finally:
+            # a cancelled half-open trial must not block every later trial
+            if admission == "trial":
+                self.breaker.end_trial()
+
+rerank_client = RerankClient()
+
+rerankers = {
+    rerank_client.name: rerank_client,
+    local_reranker.name: local_reranker,
+}
+
+async def rerank_documents(query, docs, fileids, filenames, top_k=3, scores=None, backend=RERANK_BACKEND):
+    print("Entering rerank_documents_with_flag method")
+    reranker = rerankers.get(backend, rerank_client)
+    result = await reranker.rerank(query, docs, fileids, filenames, top_k, scores)
+
+    if RERANK_COMPARE and reranker is not local_reranker:
+        baseline = await local_reranker.rerank(query, docs, fileids, filenames, top_k, scores)
+        overlap = len(set(result[0]) & set(baseline[0]))
+        print(f"[INFO] Rerank comparison: {reranker.name} {result[3]:.3f}s vs local {baseline[3]:.3f}s, top-{top_k} overlap {overlap}/{min(top_k, len(docs))}")
+
+    print("Exiting rerank_documents_with_flag method")
+    return result
@@ -2,7 +2,7 @@ import os
 import requests
 from dotenv import load_dotenv
 from util.async_ollama import ollama_chat_async
-from util.inference_limiter import ollama_semaphore
+from util.inference_limiter import inference_scheduler
 
 load_dotenv()
 
@@ -44,7 +44,7 @@ If NONE of these conditions are met, consider the <user_query> as a new standalo
 """
 
 async def rewrite_query(user_query: str, history_context: str) -> str:
-    async with ollama_semaphore:
+    async with inference_scheduler.slot("classification", model_name):
         print("Entering rewrite_query method")
 
         user = f"""
@@ -60,6 +60,7 @@ async def rewrite_query(user_query: str, history_context: str) -> str:
         """
 
         response = await ollama_chat_async(
+            stage="rewriter",
             model=model_name,
             messages=[
                 # {"role": "system", "content": prompt},
@@ -1,16 +1,84 @@
+import os
+import asyncio
+from dotenv import load_dotenv
 from fastapi import APIRouter, Header, Depends
+from fastapi.responses import StreamingResponse
 from .chatflow import ChatflowHandler
 from .entity.chat_request import ChatRequest
+from .stream_sink import StreamSink
+from .admission import admission_controller
+from .conversation_state import conversation_state_cache
+from .classify_user_query import reload_classifications
+from .enrichment import enrichment_pool
+from util.inference_limiter import inference_scheduler
+from util.write_behind import analytics_writer
+from util.config_cache import config_cache
 from middleware.auth import verify_api_key
 
+load_dotenv()
+
+STREAM_DRAIN_TIMEOUT = float(os.getenv("STREAM_DRAIN_TIMEOUT", "30"))
+
 class ChatflowRoutes:
     def __init__(self):
         self.router = APIRouter()
         self.handler = ChatflowHandler()
+        self.admission = admission_controller
+        # keep references so the chatflow keeps persisting after the client has its answer
+        self.stream_tasks = set()
         self.setup_routes()
         print("Chatflow routes initialized")
 
+    async def run_stream(self, user_query: ChatRequest, sink: StreamSink):
+        async with self.admission.track():
+            await self.handler.chatflow_stream_call(user_query, sink)
+
+    async def drain_stream_tasks(self, timeout: float = STREAM_DRAIN_TIMEOUT):
+        # called on shutdown before the DB pool closes, the chatflows still need it to persist
+        if not self.stream_tasks:
+            return
+        print(f"Waiting for {len(self.stream_tasks)} streaming chatflows")
+        _, pending = await asyncio.wait(set(self.stream_tasks), timeout=timeout)
+        if pending:
+            print(f"[WARN] Cancelling {len(pending)} streaming chatflows still running after {timeout}s")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
     def setup_routes(self):
         @self.router.post("/")
         async def chatflow_call(user_query: ChatRequest, key_checked: str = Depends(verify_api_key)):
-            return await self.handler.chatflow_call(user_query)
+            if not self.admission.admit():
+                return self.handler.handle_overload(user_query)
+            async with self.admission.track():
+                return await self.handler.chatflow_call(user_query)
+
+        @self.router.post("/stream")
+        async def chatflow_stream(user_query: ChatRequest, key_checked: str = Depends(verify_api_key)):
+            if not self.admission.admit():
+                return self.handler.handle_overload(user_query)
+            sink = StreamSink()
+            task = asyncio.create_task(self.run_stream(user_query, sink))
+            self.stream_tasks.add(task)
+            task.add_done_callback(self.stream_tasks.discard)
+            return StreamingResponse(sink.events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+        @self.router.get("/admission")
+        async def admission_status(key_checked: str = Depends(verify_api_key)):
+            return {
+                "admission": self.admission.report(),
+                "inference": inference_scheduler.report(),
+                "write_behind": analytics_writer.metrics(),
+                "conversation_state": conversation_state_cache.report(),
+                "config_cache": config_cache.report(),
+                "enrichment": enrichment_pool.report(),
+            }
+
+        @self.router.post("/classifications/reload")
+        async def reload_user_query_classifications(key_checked: str = Depends(verify_api_key)):
+            categories = await reload_classifications()
+            return {
+                "status": "reloaded",
+                "categories": len(categories),
+                "sub_categories": sum(len(subs) for subs in categories.values()),
+            }
@@ -0,0 +1,46 @@
+import json
+import asyncio
+import contextvars
+
+current_stream_sink = contextvars.ContextVar("current_stream_sink", default=None)
+
+class StreamSink:
+    """
+    Server-sent events for POST /chat/stream.
+
+    rewritten, category, citations: pipeline progress.
+    token: the next piece of answer text, append it to what was shown so far.
+    reset: the attempt streamed so far was rejected (empty or repeating); the client must
+        clear the tokens it has shown, the next attempt (or the fallback text) follows as tokens.
+    answer: the final display text, including greeting and disclaimer.
+    done: the full response, same body as POST /chat/. Ends the stream.
+    error: the request failed. Ends the stream.
+    """
+
+    TERMINAL_EVENTS = {"done", "error"}
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.closed = False
+
+    def emit(self, event: str, data: dict):
+        if self.closed:
+            return
+        self.queue.put_nowait((event, data))
+        if event in self.TERMINAL_EVENTS:
+            self.closed = True
+
+    async def events(self):
+        while True:
+            event, data = await self.queue.get()
+            yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+            if event in self.TERMINAL_EVENTS:
+                return
+
+def get_stream_sink():
+    return current_stream_sink.get()
+
+def emit_event(event: str, data: dict):
+    sink = current_stream_sink.get()
+    if sink is not None:
+        sink.emit(event, data)
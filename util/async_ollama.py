@@ -1,23 +1,42 @@
 import os
 import asyncio
-from util.ollama_client import ollama_client
+from util.ollama_client import get_async_ollama_client
+from util.inference_ledger import get_ledger
 from dotenv import load_dotenv
 
 load_dotenv()
 timeout = float(os.getenv("OLLAMA_TIMEOUT"))
 
-async def ollama_chat_async(timeout: float = timeout, **kwargs):
-    return await asyncio.wait_for(
-        asyncio.to_thread(ollama_client.chat, **kwargs),
-        timeout=timeout
-    )
+async def ollama_chat_async(timeout: float = timeout, stage: str = "unknown", **kwargs):
+    async def call():
+        # on timeout the request task is cancelled, which closes the connection and stops generation upstream
+        return await asyncio.wait_for(
+            get_async_ollama_client().chat(**kwargs),
+            timeout=timeout
+        )
+
+    ledger = get_ledger()
+    if ledger is None:
+        return await call()
+    return await ledger.run(stage, kwargs, call)
 
-async def async_embed(text: str, timeout: float = timeout):
-    return await asyncio.wait_for(
-        asyncio.to_thread(
-            ollama_client.embeddings,
-            model=os.getenv("EMBED_MODEL"),
-            prompt=text
-        ),
+async def ollama_chat_stream_async(timeout: float = timeout, stage: str = "unknown", **kwargs):
+    stream = await asyncio.wait_for(
+        get_async_ollama_client().chat(stream=True, **kwargs),
         timeout=timeout
     )
+    last_chunk = None
+    try:
+        while True:
+            try:
+                chunk = await asyncio.wait_for(anext(stream), timeout=timeout)
+            except StopAsyncIteration:
+                break
+            last_chunk = chunk
+            yield chunk
+    finally:
+        # closing the response stream drops the connection so Ollama stops generating
+        await stream.aclose()
+        ledger = get_ledger()
+        if ledger is not None and last_chunk is not None:
+            ledger.record(stage, last_chunk)
@@ -0,0 +1,200 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+import httpx
+from dotenv import load_dotenv
+from qdrant_client.models import SparseVector
+
+load_dotenv()
+
+BM25_URL = os.getenv("BM25_URL")
+BM25_TIMEOUT = float(os.getenv("BM25_TIMEOUT", "10"))
+BM25_MAX_RETRIES = int(os.getenv("BM25_MAX_RETRIES", "2"))
+BM25_BATCH_WINDOW = float(os.getenv("BM25_BATCH_WINDOW", "0.005"))
+BM25_MAX_BATCH_SIZE = int(os.getenv("BM25_MAX_BATCH_SIZE", "32"))
+BM25_CACHE_SIZE = int(os.getenv("BM25_CACHE_SIZE", "2048"))
+
+class BM25SparseClient:
+    def __init__(self, url: str = BM25_URL, timeout: float = BM25_TIMEOUT, max_retries: int = BM25_MAX_RETRIES, batch_window: float = BM25_BATCH_WINDOW, max_batch_size: int = BM25_MAX_BATCH_SIZE, cache_size: int = BM25_CACHE_SIZE):
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self.limits = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=30.0)
+        self.cache = OrderedDict()
+        self.stats = {"requests": 0, "batched_queries": 0, "cache_hits": 0, "errors": 0}
+        self._sync_client = None
+        self._async_client = None
+        self._pending = []
+        self._flush_handle = None
+        self._flush_tasks = set()
+
+    def _empty(self) -> SparseVector:
+        return SparseVector(indices=[], values=[])
+
+    def _convert_to_sparse_vector(self, vector_data) -> SparseVector:
+        if vector_data is None:
+            return self._empty()
+
+        if isinstance(vector_data, dict):
+            indices = vector_data.get("indices", [])
+            values = vector_data.get("values", [])
+        elif isinstance(vector_data, list) and vector_data and isinstance(vector_data[0], (list, tuple)):
+            indices = [int(idx) for idx, _ in vector_data]
+            values = [float(val) for _, val in vector_data]
+        else:
+            print(f"Unexpected vector format: {type(vector_data)}")
+            return self._empty()
+
+        return SparseVector(indices=indices, values=values)
+
+    def _parse_response(self, response: httpx.Response, texts: list[str]) -> list[SparseVector]:
+        response.raise_for_status()
+        vectors = response.json().get("vectors", [])
+        if len(vectors) != len(texts):
+            raise ValueError(f"BM25 returned {len(vectors)} vectors for {len(texts)} texts")
+        return [self._convert_to_sparse_vector(v) for v in vectors]
+
+    def _cache_get(self, text: str):
+        vector = self.cache.get(text)
+        if vector is not None:
+            self.cache.move_to_end(text)
+            self.stats["cache_hits"] += 1
+        return vector
+
+    def _cache_put(self, text: str, vector: SparseVector):
+        if not vector.indices:
+            return
+        self.cache[text] = vector
+        self.cache.move_to_end(text)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # --- synchronous interface, used by LangChain during ingestion ---
+
+    def _get_sync_client(self) -> httpx.Client:
+        if self._sync_client is None:
+            self._sync_client = httpx.Client(timeout=self.timeout, limits=self.limits)
+        return self._sync_client
+
+    def _post_sync(self, texts: list[str]) -> list[SparseVector]:
+        client = self._get_sync_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.stats["requests"] += 1
+                response = client.post(self.url, json={"texts": texts})
+                return self._parse_response(response, texts)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"BM25 request error (attempt {attempt + 1}/{self.max_retries + 1}):", e)
+                if attempt < self.max_retries:
+                    time.sleep(0.2 * (2 ** attempt))
+        return [self._empty() for _ in texts]
+
+    def embed_documents(self, texts: list[str]) -> list[SparseVector]:
+        if not texts:
+            return []
+        return self._post_sync(texts)
+
+    def embed_query(self, text: str) -> SparseVector:
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached
+        vector = self._post_sync([text])[0]
+        self._cache_put(text, vector)
+        return vector
+
+    # --- asynchronous interface, used by retrieval ---
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None or self._async_client.is_closed:
+            self._async_client = httpx.AsyncClient(timeout=self.timeout, limits=self.limits)
+        return self._async_client
+
+    async def _post_async(self, texts: list[str]) -> list[SparseVector]:
+        client = self._get_async_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.stats["requests"] += 1
+                response = await client.post(self.url, json={"texts": texts})
+                return self._parse_response(response, texts)
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"BM25 request error (attempt {attempt + 1}/{self.max_retries + 1}):", e)
+                if attempt < self.max_retries:
+                    await asyncio.sleep(0.2 * (2 ** attempt))
+        return [self._empty() for _ in texts]
+
+    async def aembed_documents(self, texts: list[str]) -> list[SparseVector]:
+        if not texts:
+            return []
+        return await self._post_async(texts)
+
+    def _start_flush(self):
+        # keep a reference so the task is not garbage-collected before it resolves the waiters
+        task = asyncio.ensure_future(self._flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    def _schedule_flush(self):
+        if len(self._pending) >= self.max_batch_size:
+            if self._flush_handle is not None:
+                self._flush_handle.cancel()
+                self._flush_handle = None
+            self._start_flush()
+        elif self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.batch_window, self._start_flush)
+
+    async def _flush(self):
+        self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.stats["batched_queries"] += len(batch)
+        # _post_async never raises, failed requests come back as empty vectors
+        try:
+            vectors = dict(zip(texts, await self._post_async(texts)))
+        except asyncio.CancelledError:
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
+            raise
+
+        for text, vector in vectors.items():
+            self._cache_put(text, vector)
+        for text, future in batch:
+            if not future.done():
+                future.set_result(vectors[text])
+
+    async def aembed_query(self, text: str) -> SparseVector:
+        cached = self._cache_get(text)
+        if cached is not None:
+            return cached
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((text, future))
+        self._schedule_flush()
+        return await future
+
+    async def aclose(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._pending:
+            await self._flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+        if self._sync_client is not None:
+            self._sync_client.close()
+            self._sync_client = None
+
+bm25_client = BM25SparseClient()
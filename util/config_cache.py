@@ -0,0 +1,126 @@
+import os
+import time
+import asyncio
+import asyncpg
+from dotenv import load_dotenv
+from util.db_connection import DB_URL
+
+load_dotenv()
+
+CONFIG_CACHE_TTL = float(os.getenv("CONFIG_CACHE_TTL", "60"))
+CONFIG_CACHE_MAX_STALE = float(os.getenv("CONFIG_CACHE_MAX_STALE", "600"))
+CONFIG_CACHE_CHANNEL = os.getenv("CONFIG_CACHE_CHANNEL", "config_cache")
+CONFIG_CACHE_LISTEN = os.getenv("CONFIG_CACHE_LISTEN", "true").lower() == "true"
+
+class ConfigCache:
+    """
+    Small cache for rarely-changing settings tables.
+
+    Values are served for CONFIG_CACHE_TTL seconds. After that the stale value is still
+    served while one background refresh runs, up to CONFIG_CACHE_MAX_STALE. A
+    `NOTIFY config_cache, '<key>'` (or '*') from Postgres drops the entry immediately.
+    """
+
+    def __init__(self, ttl: float = CONFIG_CACHE_TTL, max_stale: float = CONFIG_CACHE_MAX_STALE, channel: str = CONFIG_CACHE_CHANNEL):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.channel = channel
+        self.loaders = {}
+        self.entries = {}
+        self.refreshing = {}
+        self.stats = {"hits": 0, "stale_hits": 0, "loads": 0, "load_errors": 0, "notifications": 0}
+        self._listener_task = None
+        self._listener_conn = None
+
+    def register(self, key: str, loader):
+        self.loaders[key] = loader
+
+    def _refresh(self, key: str):
+        task = self.refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key))
+            self.refreshing[key] = task
+            task.add_done_callback(lambda _: self.refreshing.pop(key, None))
+        return task
+
+    async def _load(self, key: str):
+        self.stats["loads"] += 1
+        try:
+            value = await self.loaders[key]()
+        except Exception as e:
+            self.stats["load_errors"] += 1
+            print(f"[ERROR] Config cache failed to load '{key}': {e}")
+            raise
+        self.entries[key] = (value, time.monotonic())
+        return value
+
+    async def get(self, key: str):
+        entry = self.entries.get(key)
+        if entry is not None:
+            value, loaded_at = entry
+            age = time.monotonic() - loaded_at
+            if age <= self.ttl:
+                self.stats["hits"] += 1
+                return value
+            if age <= self.max_stale:
+                self.stats["stale_hits"] += 1
+                refresh = self._refresh(key)
+                # a failed background refresh keeps serving the stale value
+                refresh.add_done_callback(lambda f: f.cancelled() or f.exception())
+                return value
+
+        return await asyncio.shield(self._refresh(key))
+
+    def invalidate(self, key: str = "*"):
+        if key == "*":
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+        print(f"[INFO] Config cache invalidated: {key}")
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.stats["notifications"] += 1
+        self.invalidate((payload or "*").strip())
+
+    async def _listen(self):
+        while True:
+            try:
+                self._listener_conn = await asyncpg.connect(DB_URL)
+                await self._listener_conn.add_listener(self.channel, self._on_notify)
+                print(f"Config cache listening on channel '{self.channel}'")
+                while not self._listener_conn.is_closed():
+                    await asyncio.sleep(5)
+                print("[WARN] Config cache listener connection closed, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[ERROR] Config cache listener failed: {e}")
+            # notifications may have been missed while disconnected
+            self.invalidate()
+            await asyncio.sleep(5)
+
+    async def start(self):
+        if CONFIG_CACHE_LISTEN and self._listener_task is None:
+            self._listener_task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener_task is not None:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._listener_conn is not None and not self._listener_conn.is_closed():
+            await self._listener_conn.close()
+        self._listener_conn = None
+
+    def report(self) -> dict:
+        now = time.monotonic()
+        return {
+            "keys": {key: round(now - loaded_at, 1) for key, (_, loaded_at) in self.entries.items()},
+            "listening": self._listener_conn is not None and not self._listener_conn.is_closed(),
+            **self.stats,
+        }
+
+config_cache = ConfigCache()
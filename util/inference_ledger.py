@@ -0,0 +1,86 @@
+import json
+import hashlib
+import asyncio
+import contextvars
+
+current_ledger = contextvars.ContextVar("current_ledger", default=None)
+
+class InferenceLedger:
+    def __init__(self):
+        self.stages = {}
+        self.deduplicated = 0
+        self._inflight = {}
+
+    def _make_key(self, kwargs: dict) -> str:
+        payload = {
+            "model": kwargs.get("model"),
+            "messages": kwargs.get("messages"),
+            "options": kwargs.get("options"),
+            "format": kwargs.get("format"),
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def record(self, stage: str, response):
+        entry = self.stages.setdefault(stage, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        entry["calls"] += 1
+        try:
+            entry["prompt_tokens"] += response.get("prompt_eval_count") or 0
+            entry["completion_tokens"] += response.get("eval_count") or 0
+        except AttributeError:
+            pass
+
+    async def run(self, stage: str, kwargs: dict, call):
+        key = self._make_key(kwargs)
+        future = self._inflight.get(key)
+        if future is not None:
+            print(f"[INFO] Reusing identical {stage} inference within this request")
+            try:
+                response = await asyncio.shield(future)
+                self.deduplicated += 1
+                return response
+            except asyncio.CancelledError:
+                # only fall through when the original caller was cancelled, not us
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            response = await call()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # mark the exception as retrieved so asyncio does not warn when nobody waits on it
+            future.exception()
+            raise
+        finally:
+            # only concurrent identical calls share a result; a later call (e.g. a retry after
+            # an empty or repeating answer) must reach the model again
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+        future.set_result(response)
+        self.record(stage, response)
+        return response
+
+    @property
+    def total_calls(self) -> int:
+        return sum(entry["calls"] for entry in self.stages.values())
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(entry["prompt_tokens"] + entry["completion_tokens"] for entry in self.stages.values())
+
+    def summary(self) -> dict:
+        return {
+            "llm_calls": self.total_calls,
+            "llm_tokens": self.total_tokens,
+            "deduplicated": self.deduplicated,
+            "stages": self.stages,
+        }
+
+def get_ledger():
+    return current_ledger.get()
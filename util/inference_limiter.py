@@ -1,5 +1,228 @@
 import os
+import time
 import asyncio
+import itertools
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
 
+load_dotenv()
+
+# per model: every model gets its own pool of SEMAPHORE_NUM slots
 OLLAMA_MAX_CONCURRENCY = int(os.getenv("SEMAPHORE_NUM"))
-ollama_semaphore = asyncio.Semaphore(OLLAMA_MAX_CONCURRENCY)
\ No newline at end of file
+# across all models on the Ollama host, 0 means no cap beyond the per-model one
+OLLAMA_HOST_MAX_CONCURRENCY = int(os.getenv("OLLAMA_HOST_MAX_CONCURRENCY", "0"))
+DEFAULT_MODEL = os.getenv("LLM_MODEL")
+
+# lane name -> (priority, max concurrent calls, max queued calls); lower priority runs first
+LANES = {
+    "classification": (0, int(os.getenv("INFERENCE_CLASSIFICATION_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY))), int(os.getenv("INFERENCE_CLASSIFICATION_MAX_QUEUE", "64"))),
+    "generation": (1, int(os.getenv("INFERENCE_GENERATION_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY))), int(os.getenv("INFERENCE_GENERATION_MAX_QUEUE", "32"))),
+    "enrichment": (2, int(os.getenv("INFERENCE_ENRICHMENT_CONCURRENCY", str(OLLAMA_MAX_CONCURRENCY))), int(os.getenv("INFERENCE_ENRICHMENT_MAX_QUEUE", "128"))),
+}
+
+current_conversation = contextvars.ContextVar("current_conversation", default=None)
+
+class InferenceQueueFull(Exception):
+    pass
+
+class Lane:
+    def __init__(self, name: str, priority: int, capacity: int, max_queue: int):
+        self.name = name
+        self.priority = priority
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.in_use = 0
+        self.queued = 0
+        self.waits = deque(maxlen=500)
+        self.stats = {"granted": 0, "rejected": 0, "cancelled": 0, "wait_total": 0.0, "wait_max": 0.0}
+
+    def record_wait(self, wait: float):
+        self.waits.append(wait)
+        self.stats["granted"] += 1
+        self.stats["wait_total"] += wait
+        self.stats["wait_max"] = max(self.stats["wait_max"], wait)
+
+    def report(self) -> dict:
+        waits = sorted(self.waits)
+        granted = self.stats["granted"]
+        return {
+            "priority": self.priority,
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "granted": granted,
+            "rejected": self.stats["rejected"],
+            "cancelled": self.stats["cancelled"],
+            "wait_avg": self.stats["wait_total"] / granted if granted else 0.0,
+            "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+            "wait_max": self.stats["wait_max"],
+        }
+
+class HostLimit:
+    """Caps concurrent calls across every ModelPool served by the same Ollama host."""
+
+    def __init__(self, capacity: int = OLLAMA_HOST_MAX_CONCURRENCY):
+        self.capacity = capacity
+        self.in_use = 0
+        self.pools = []
+        self.sequence = itertools.count()
+
+    def has_room(self) -> bool:
+        return not self.capacity or self.in_use < self.capacity
+
+    def dispatch(self):
+        for pool in self.pools:
+            pool._drop_cancelled()
+
+        while self.has_room():
+            best = None
+            for pool in self.pools:
+                if pool.in_use >= pool.capacity:
+                    continue
+                waiter = pool._pick_waiter()
+                if waiter is None:
+                    continue
+                # across models the oldest waiter of the most urgent lane goes first
+                key = (waiter["lane"].priority, waiter["seq"])
+                if best is None or key < best[0]:
+                    best = (key, pool, waiter)
+            if best is None:
+                return
+            _, pool, waiter = best
+            pool._drop_waiter(waiter)
+            pool._grant(waiter["lane"], waiter["conversation"])
+            waiter["future"].set_result(None)
+
+    def report(self) -> dict:
+        return {"capacity": self.capacity, "in_use": self.in_use}
+
+class ModelPool:
+    """All lanes that share one model's inference capacity."""
+
+    def __init__(self, model: str, capacity: int = OLLAMA_MAX_CONCURRENCY, lanes: dict = LANES, host: HostLimit = None):
+        self.model = model
+        self.capacity = capacity
+        self.in_use = 0
+        self.lanes = {name: Lane(name, *config) for name, config in lanes.items()}
+        self.waiters = []
+        self.active_by_conversation = {}
+        self.host = host if host is not None else HostLimit(0)
+        self.host.pools.append(self)
+        self.sequence = self.host.sequence
+
+    def _pick_waiter(self):
+        best = None
+        for waiter in self.waiters:
+            if waiter["lane"].in_use >= waiter["lane"].capacity:
+                continue
+            # conversations already holding slots go behind others of the same priority
+            key = (waiter["lane"].priority, self.active_by_conversation.get(waiter["conversation"], 0), waiter["seq"])
+            if best is None or key < best[0]:
+                best = (key, waiter)
+        return best[1] if best else None
+
+    def _drop_waiter(self, waiter: dict):
+        self.waiters.remove(waiter)
+        waiter["lane"].queued -= 1
+
+    def _drop_cancelled(self):
+        # a waiter cancelled while queued keeps its entry until its task resumes, never grant to it
+        for waiter in [w for w in self.waiters if w["future"].done()]:
+            self._drop_waiter(waiter)
+
+    def _dispatch(self):
+        # a freed slot on this model can also be what another model on the host was waiting for
+        self.host.dispatch()
+
+    def _grant(self, lane: Lane, conversation):
+        self.host.in_use += 1
+        self.in_use += 1
+        lane.in_use += 1
+        if conversation is not None:
+            self.active_by_conversation[conversation] = self.active_by_conversation.get(conversation, 0) + 1
+
+    def _release(self, lane: Lane, conversation):
+        self.host.in_use -= 1
+        self.in_use -= 1
+        lane.in_use -= 1
+        if conversation is not None:
+            remaining = self.active_by_conversation.get(conversation, 1) - 1
+            if remaining:
+                self.active_by_conversation[conversation] = remaining
+            else:
+                self.active_by_conversation.pop(conversation, None)
+        self._dispatch()
+
+    async def acquire(self, lane: Lane, conversation):
+        start = time.perf_counter()
+        can_start = self.in_use < self.capacity and lane.in_use < lane.capacity and self.host.has_room()
+        if not can_start and lane.queued >= lane.max_queue:
+            lane.stats["rejected"] += 1
+            raise InferenceQueueFull(f"Inference lane '{lane.name}' for model '{self.model}' is full ({lane.queued} queued)")
+
+        waiter = {
+            "lane": lane,
+            "conversation": conversation,
+            "seq": next(self.sequence),
+            "future": asyncio.get_running_loop().create_future(),
+        }
+        self.waiters.append(waiter)
+        lane.queued += 1
+        self._dispatch()
+        try:
+            await waiter["future"]
+        except asyncio.CancelledError:
+            lane.stats["cancelled"] += 1
+            if waiter in self.waiters:
+                self._drop_waiter(waiter)
+            elif waiter["future"].done() and not waiter["future"].cancelled():
+                # the slot was granted just before we were cancelled, hand it back
+                self._release(lane, conversation)
+            raise
+        lane.record_wait(time.perf_counter() - start)
+
+    def report(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "queued": len(self.waiters),
+            "host": self.host.report(),
+            "lanes": {name: lane.report() for name, lane in self.lanes.items()},
+        }
+
+class InferenceScheduler:
+    def __init__(self, lanes: dict = LANES, capacity: int = OLLAMA_MAX_CONCURRENCY, host_capacity: int = OLLAMA_HOST_MAX_CONCURRENCY):
+        self.lane_config = lanes
+        self.capacity = capacity
+        self.host = HostLimit(host_capacity)
+        self.pools = {}
+        print("InferenceScheduler initialized")
+
+    def pool(self, model: str = None) -> ModelPool:
+        model = model or DEFAULT_MODEL
+        pool = self.pools.get(model)
+        if pool is None:
+            pool = self.pools[model] = ModelPool(model, self.capacity, self.lane_config, self.host)
+        return pool
+
+    @asynccontextmanager
+    async def slot(self, lane: str, model: str = None):
+        pool = self.pool(model)
+        lane = pool.lanes[lane]
+        conversation = current_conversation.get()
+        await pool.acquire(lane, conversation)
+        try:
+            yield
+        finally:
+            pool._release(lane, conversation)
+
+    def queue_depth(self, model: str = None) -> int:
+        return len(self.pool(model).waiters)
+
+    def report(self) -> dict:
+        return {model: pool.report() for model, pool in self.pools.items()}
+
+inference_scheduler = InferenceScheduler()
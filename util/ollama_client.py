@@ -1,7 +1,34 @@
 import os
+import httpx
 import ollama
 from dotenv import load_dotenv
 
 load_dotenv()
 
-ollama_client = ollama.Client(host=os.getenv("OLLAMA_BASE_URL"))
\ No newline at end of file
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL")
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_KEEPALIVE_CONNECTIONS = int(os.getenv("OLLAMA_KEEPALIVE_CONNECTIONS", "16"))
+
+async_ollama_client = None
+
+def init_async_ollama_client():
+    global async_ollama_client
+    if async_ollama_client is None:
+        # timeouts are enforced per call by the caller so cancelling the task aborts the request
+        async_ollama_client = ollama.AsyncClient(
+            host=OLLAMA_BASE_URL,
+            timeout=None,
+            limits=httpx.Limits(max_connections=OLLAMA_MAX_CONNECTIONS, max_keepalive_connections=OLLAMA_KEEPALIVE_CONNECTIONS, keepalive_expiry=30.0),
+        )
+    return async_ollama_client
+
+async def close_async_ollama_client():
+    global async_ollama_client
+    if async_ollama_client is not None:
+        await async_ollama_client._client.aclose()
+        async_ollama_client = None
+
+def get_async_ollama_client():
+    if async_ollama_client is None:
+        return init_async_ollama_client()
+    return async_ollama_client
@@ -1,10 +1,15 @@
 import os
 from dotenv import load_dotenv
-from qdrant_client import QdrantClient
+from qdrant_client import QdrantClient, AsyncQdrantClient
 
 load_dotenv()
 
 vectordb_client = QdrantClient(
     url=os.getenv("QDRANT_URL"),
     timeout=60.0
-)
\ No newline at end of file
+)
+
+async_vectordb_client = AsyncQdrantClient(
+    url=os.getenv("QDRANT_URL"),
+    timeout=60.0
+)
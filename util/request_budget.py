@@ -0,0 +1,22 @@
+import os
+import time
+import contextvars
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REQUEST_BUDGET_SECONDS = float(os.getenv("REQUEST_BUDGET_SECONDS", "120"))
+
+request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+def start_request_budget(budget: float = REQUEST_BUDGET_SECONDS):
+    return request_deadline.set(time.monotonic() + budget)
+
+def reset_request_budget(token):
+    request_deadline.reset(token)
+
+def remaining_budget(default: float = None):
+    deadline = request_deadline.get()
+    if deadline is None:
+        return default
+    return deadline - time.monotonic()
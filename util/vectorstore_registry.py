@@ -0,0 +1,52 @@
+import threading
+from langchain_qdrant import QdrantVectorStore, RetrievalMode
+from util.qdrant_connection import vectordb_client
+
+class VectorStoreRegistry:
+    def __init__(self, client=vectordb_client):
+        self.client = client
+        self.stores = {}
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0}
+        self._lock = threading.Lock()
+
+    def get_store(self, collection_name: str, retrieval_mode: RetrievalMode, embedding, sparse_embedding=None):
+        key = (collection_name, retrieval_mode)
+        with self._lock:
+            store = self.stores.get(key)
+            if store is not None:
+                self.stats["hits"] += 1
+                return store
+
+            self.stats["misses"] += 1
+            print(f"[INFO] Building vector store for {collection_name} ({retrieval_mode.value})")
+            kwargs = {
+                "client": self.client,
+                "collection_name": collection_name,
+                "embedding": embedding,
+                "retrieval_mode": retrieval_mode,
+                "vector_name": "dense",
+            }
+            if retrieval_mode != RetrievalMode.DENSE:
+                kwargs["sparse_embedding"] = sparse_embedding
+                kwargs["sparse_vector_name"] = "sparse"
+
+            store = QdrantVectorStore(**kwargs)
+            self.stores[key] = store
+            return store
+
+    def refresh(self, collection_name: str):
+        with self._lock:
+            stale = [key for key in self.stores if key[0] == collection_name]
+            for key in stale:
+                del self.stores[key]
+            self.stats["refreshes"] += 1
+        print(f"[INFO] Vector store registry refreshed for {collection_name}")
+
+    def report(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "cached": [f"{name}:{mode.value}" for name, mode in self.stores],
+            }
+
+vectorstore_registry = VectorStoreRegistry()
@@ -0,0 +1,65 @@
+import os
+import time
+import asyncio
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+VLM_BASE_URL = os.getenv("OLLAMA_BASE_URL")
+VLM_TIMEOUT = float(os.getenv("VLM_TIMEOUT", "600"))
+# shared by every ingestion job, so it should match what the VLM server can run in parallel
+VLM_CONCURRENCY = int(os.getenv("VLM_CONCURRENCY", "4"))
+
+class VLMClient:
+    """Pooled client for OCR calls to the Ollama /api/chat endpoint."""
+
+    def __init__(self, base_url: str = VLM_BASE_URL, timeout: float = VLM_TIMEOUT, concurrency: int = VLM_CONCURRENCY):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.client = None
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.in_flight = 0
+        self.stats = {"requests": 0, "errors": 0, "total_duration": 0.0}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self.client is None or self.client.is_closed:
+            self.client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency, keepalive_expiry=60.0)
+            )
+        return self.client
+
+    async def chat(self, payload: dict) -> str:
+        async with self.semaphore:
+            self.in_flight += 1
+            start = time.perf_counter()
+            try:
+                resp = await self._get_client().post(f"{self.base_url.rstrip('/')}/api/chat", json=payload)
+                resp.raise_for_status()
+                return resp.json()["message"]["content"]
+            except Exception:
+                self.stats["errors"] += 1
+                raise
+            finally:
+                self.in_flight -= 1
+                self.stats["requests"] += 1
+                self.stats["total_duration"] += time.perf_counter() - start
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            print("VLM client closed")
+
+    def report(self) -> dict:
+        requests = self.stats["requests"]
+        return {
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "avg_duration": self.stats["total_duration"] / requests if requests else 0.0,
+            **self.stats,
+        }
+
+vlm_client = VLMClient()
@@ -0,0 +1,169 @@
+import os
+import time
+import asyncio
+from collections import deque
+from dotenv import load_dotenv
+from util.db_connection import get_pool
+
+load_dotenv()
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", "1.0"))
+WRITE_BEHIND_MAX_BACKLOG = int(os.getenv("WRITE_BEHIND_MAX_BACKLOG", "10000"))
+WRITE_BEHIND_MAX_RETRIES = int(os.getenv("WRITE_BEHIND_MAX_RETRIES", "3"))
+WRITE_BEHIND_DROP_LOG_INTERVAL = float(os.getenv("WRITE_BEHIND_DROP_LOG_INTERVAL", "10"))
+
+class WriteBehindQueue:
+    """Buffers fire-and-forget statements and applies them in batches with executemany."""
+
+    def __init__(self, name: str, enabled: bool = WRITE_BEHIND_ENABLED, batch_size: int = WRITE_BEHIND_BATCH_SIZE, flush_interval: float = WRITE_BEHIND_FLUSH_INTERVAL, max_backlog: int = WRITE_BEHIND_MAX_BACKLOG, max_retries: int = WRITE_BEHIND_MAX_RETRIES):
+        self.name = name
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self.max_retries = max_retries
+        self.pending = deque()
+        self.stats = {"enqueued": 0, "written": 0, "batches": 0, "errors": 0, "dropped": 0, "last_flush_duration": 0.0}
+        self._wake = None
+        self._task = None
+        self._flush_lock = None
+        self._stopping = False
+        self._drops_unlogged = 0
+        self._drop_logged_at = None
+
+    def _record_drops(self, count: int, reason: str):
+        self.stats["dropped"] += count
+        self._drops_unlogged += count
+        now = time.monotonic()
+        # a full backlog drops on every write, so only log a summary every few seconds
+        if self._drop_logged_at is None or now - self._drop_logged_at >= WRITE_BEHIND_DROP_LOG_INTERVAL:
+            print(f"[WARN] WriteBehindQueue '{self.name}' dropped {self._drops_unlogged} writes ({reason}), {self.stats['dropped']} in total")
+            self._drops_unlogged = 0
+            self._drop_logged_at = now
+
+    async def start(self):
+        if not self.enabled or self._task is not None:
+            return
+        self._wake = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        print(f"WriteBehindQueue '{self.name}' started")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        # let the loop finish its current flush instead of cancelling it halfway through a batch
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        # one final drain so nothing buffered is lost on a clean shutdown; keep going while
+        # flushes make progress so one bad row does not strand the writes queued behind it
+        while self.pending:
+            written, dropped = self.stats["written"], self.stats["dropped"]
+            if not await self.flush() and (written, dropped) == (self.stats["written"], self.stats["dropped"]):
+                break
+        print(f"WriteBehindQueue '{self.name}' stopped, {len(self.pending)} writes left unflushed")
+
+    async def execute(self, query: str, *args):
+        """Queue the statement when the writer is running, otherwise run it inline."""
+        if self._task is None:
+            pool = await get_pool()
+            async with pool.acquire() as conn:
+                await conn.execute(query, *args)
+            return
+
+        if len(self.pending) >= self.max_backlog:
+            self.pending.popleft()
+            self._record_drops(1, "backlog full")
+        self.pending.append({"query": query, "args": args, "attempts": 0, "queued_at": time.monotonic()})
+        self.stats["enqueued"] += 1
+        if len(self.pending) >= self.batch_size:
+            self._wake.set()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            while self.pending and not self._stopping:
+                if not await self.flush():
+                    break
+
+    async def _apply_rows(self, batch: list) -> list:
+        """Runs each statement on its own so one bad row does not fail its neighbours. Returns the failed items."""
+        failed = []
+        pool = await get_pool()
+        async with pool.acquire() as conn:
+            for item in batch:
+                try:
+                    await conn.execute(item["query"], *item["args"])
+                except Exception as e:
+                    print(f"[ERROR] WriteBehindQueue '{self.name}' write failed: {e}")
+                    failed.append(item)
+        return failed
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            batch = [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+            if not batch:
+                return True
+
+            grouped = {}
+            for item in batch:
+                grouped.setdefault(item["query"], []).append(item["args"])
+
+            start = time.perf_counter()
+            try:
+                pool = await get_pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        for query, rows in grouped.items():
+                            await conn.executemany(query, rows)
+            except asyncio.CancelledError:
+                self.pending.extendleft(reversed(batch))
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"[ERROR] WriteBehindQueue '{self.name}' flush of {len(batch)} writes failed, retrying row by row: {e}")
+                try:
+                    failed = await self._apply_rows(batch)
+                except asyncio.CancelledError:
+                    self.pending.extendleft(reversed(batch))
+                    raise
+                except Exception as e:
+                    print(f"[ERROR] WriteBehindQueue '{self.name}' row by row retry failed: {e}")
+                    failed = batch
+                self.stats["written"] += len(batch) - len(failed)
+                if not failed:
+                    return True
+
+                retry = [item for item in failed if item["attempts"] < self.max_retries]
+                for item in retry:
+                    item["attempts"] += 1
+                if len(failed) > len(retry):
+                    self._record_drops(len(failed) - len(retry), "out of retries")
+                self.pending.extendleft(reversed(retry))
+                return False
+
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_flush_duration"] = time.perf_counter() - start
+            return True
+
+    def metrics(self) -> dict:
+        oldest = self.pending[0]["queued_at"] if self.pending else None
+        return {
+            "name": self.name,
+            "running": self._task is not None,
+            "backlog": len(self.pending),
+            "oldest_age": time.monotonic() - oldest if oldest is not None else 0.0,
+            **self.stats,
+        }
+
+analytics_writer = WriteBehindQueue("analytics")